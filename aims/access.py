@@ -1,14 +1,65 @@
 #!/usr/bin/python3
 
+import datetime as dt
+import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+from urllib3.util.timeout import Timeout
 from bs4 import BeautifulSoup # type: ignore
+from dateutil.relativedelta import relativedelta
 from aims.mytypes import *
+from aims import spans, stats
 import sys
+from typing import Dict
 
 REQUEST_TIMEOUT=60
 
+#Seconds allowed to establish a connection to any server
+CONNECT_TIMEOUT = 10
+
+#Seconds allowed for AIMS to respond, keyed on the end of the URL
+#path. Sign on pages are slow and use REQUEST_TIMEOUT.
+READ_TIMEOUTS = {
+    "perinfo.exe/schedule": 30,
+    "perinfo.exe/getlegmem": 20,
+    "perinfo.exe/index": 20,
+}
+
+#GET requests that fail with a connection error or one of
+#RETRY_STATUSES are retried up to RETRIES times, waiting
+#BACKOFF * 2 ** (retry - 1) seconds, plus up to BACKOFF_JITTER
+#seconds, before each retry.
+RETRIES = 3
+BACKOFF = 0.5
+BACKOFF_JITTER = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+#Number of connections kept open to each server. Should match the
+#number of pages downloaded simultaneously (process.FETCH_WORKERS), so
+#that concurrent downloads reuse connections rather than opening and
+#closing extra ones.
+POOL_SIZE = 4
+
+#Entry point of the Crew Portal sign on procedure
+CONNECT_URL = "https://connected.easyjet.com"
+
+#Found in the AIMS index page but not in any login or error page
+INDEX_MARKER = "var notification"
+
+#Found in the AIMS index page when there are no roster changes to
+#acknowledge ("red writing")
+NO_CHANGES_MARKER = '\r\nvar notification = Trim("");\r\n'
+
+#Each day of a brief roster is in a div with an id of myday_<aims_day>
+_ROSTER_DAY_RE = re.compile(r'id="myday_(\d+)"')
+
 _session = None
 _aims_url = None
+_navigator = None
+_deadline = None # type: Optional[float]
 
 def fprint(str_: str) -> None:
     """Send str to stderr then immediately flush.
@@ -20,19 +71,210 @@ def fprint(str_: str) -> None:
     sys.stderr.flush()
 
 
+def _endpoint(method: str, url: str) -> str:
+    """Name the endpoint of a request for stats, e.g. "GET getlegmem"."""
+    path = urlparse(url).path
+    if "perinfo.exe/" in path:
+        name = path.rsplit("/", 1)[1]
+    elif "saml" in path.lower():
+        name = "saml"
+    else:
+        name = "signon"
+    return "{} {}".format(method, name)
+
+
 def _check_response(r: requests.Response, *args, **kwargs) -> None:
     """Checks the response from a request; raises exceptions as required.
+
+    The response is also recorded with stats.record_request(). Its body
+    is read here so that the time taken to receive it is included.
     """
     fprint(".")
+    start = time.monotonic()
+    content = len(r.content)
+    seconds = r.elapsed.total_seconds() + time.monotonic() - start
+    wire = r.raw.tell() if hasattr(r.raw, "tell") else content
+    stats.record_request(_endpoint(r.request.method, r.url), seconds,
+                         wire, content, r.ok)
     r.raise_for_status()
 
 
-def connect(username:str, password:str) -> None:
+def transfer_stats() -> Dict[str, Tuple[int, int]]:
+    """Return the number of bytes received from each endpoint.
+
+    Returns:
+        A dictionary mapping endpoint names, e.g. "GET getlegmem", to
+        (wire, decoded) tuples. wire is the number of body bytes
+        received, decoded the number after decompression. Counts
+        accumulate until stats.reset() is called.
+    """
+    return {K: (V["wire_bytes"], V["bytes"])
+            for K, V in stats.snapshot()["endpoints"].items()}
+
+
+class DeadlineExceeded(requests.Timeout):
+    """The deadline set by set_deadline() has passed."""
+
+
+def set_deadline(seconds: Optional[float]) -> None:
+    """Limit the time that the remaining requests may take.
+
+    Args:
+        seconds: The number of seconds from now after which no more
+            requests are made; any that are attempted raise
+            DeadlineExceeded. Requests in progress, including their
+            retries, are timed out at the deadline and then also
+            raise DeadlineExceeded. None removes the limit.
+    """
+    global _deadline
+    _deadline = None if seconds is None else time.monotonic() + seconds
+
+
+def remaining_time() -> Optional[float]:
+    """Return the seconds left before the deadline, or None if none is set."""
+    return None if _deadline is None else _deadline - time.monotonic()
+
+
+class _DeadlineTimeout(Timeout):
+    """A Timeout that is cut short by the deadline.
+
+    urllib3 clones the timeout for every attempt at a request, so each
+    retry is limited to the time then remaining.
+    """
+
+    def clone(self) -> Timeout:
+        remaining = remaining_time()
+        if remaining is None:
+            return super().clone()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        connect, read = (remaining if X is None else min(X, remaining)
+                         for X in (self._connect, self._read))
+        return Timeout(connect=connect, read=read)
+
+
+class _DeadlineRetry(Retry):
+    """A Retry that does not wait beyond the deadline."""
+
+    def sleep(self, response=None) -> None:
+        remaining = remaining_time()
+        if remaining is None:
+            return super().sleep(response)
+        wait = None
+        if response is not None and self.respect_retry_after_header:
+            wait = self.get_retry_after(response)
+        if wait is None:
+            wait = self.get_backoff_time()
+        if wait >= remaining:
+            raise DeadlineExceeded("Deadline exceeded")
+        time.sleep(wait)
+
+
+def _retry(retries: int, backoff: float, jitter: float) -> Retry:
+    kwargs = dict(total=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET"]),
+                  raise_on_status=False)
+    try:
+        return _DeadlineRetry(backoff_jitter=jitter, **kwargs)
+    except TypeError:
+        #urllib3 < 2 has no jitter
+        return _DeadlineRetry(**kwargs)
+
+
+class TransportPolicy(HTTPAdapter):
+    """An HTTPAdapter that applies timeouts, retries and the deadline.
+
+    Args:
+        read_timeouts: Read timeouts keyed on the end of the URL path,
+            as described for READ_TIMEOUTS.
+        retries, backoff, jitter: See RETRIES, BACKOFF and
+            BACKOFF_JITTER.
+
+    A timeout passed explicitly to a request takes precedence over
+    read_timeouts, but is still cut short by the deadline.
+    """
+
+    def __init__(self, read_timeouts: Optional[Dict[str, float]] = None,
+                 retries: int = RETRIES, backoff: float = BACKOFF,
+                 jitter: float = BACKOFF_JITTER, **kwargs) -> None:
+        self.read_timeouts = (READ_TIMEOUTS if read_timeouts is None
+                              else read_timeouts)
+        super().__init__(max_retries=_retry(retries, backoff, jitter),
+                         **kwargs)
+
+    def timeout_for(self, url: str) -> Tuple[float, float]:
+        """Return the (connect, read) timeout for a URL."""
+        path = urlparse(url).path
+        read = next((V for K, V in self.read_timeouts.items()
+                     if path.endswith(K)), REQUEST_TIMEOUT)
+        return CONNECT_TIMEOUT, read
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout_for(request.url)
+        endpoint = _endpoint(request.method, request.url)
+        start = time.monotonic()
+        try:
+            if _deadline is not None:
+                if _deadline <= start:
+                    raise DeadlineExceeded("Deadline exceeded",
+                                           request=request)
+                connect, read = (timeout if isinstance(timeout, tuple)
+                                 else (timeout, timeout))
+                timeout = _DeadlineTimeout(connect=connect, read=read)
+            with spans.span(endpoint):
+                return super().send(request, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            #no response, so _check_response() will not see it
+            stats.record_request(endpoint, time.monotonic() - start,
+                                 ok=False)
+            if (_deadline is not None and not isinstance(e, DeadlineExceeded)
+                    and (_deadline <= time.monotonic() or
+                         (e.args and isinstance(e.args[0], DeadlineExceeded)))):
+                #however requests wrapped it, the request ran out of time
+                raise DeadlineExceeded("Deadline exceeded",
+                                       request=request) from e
+            raise
+
+
+def _new_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """Create a requests.Session set up to look like a web browser.
+
+    Args:
+        pool_size: The number of connections to keep open to each
+            server. Requests beyond this wait for a free connection.
+
+    Requests made with the session are subject to the timeouts, retries
+    and deadline applied by TransportPolicy. Connections are kept alive
+    between requests and compressed responses are accepted.
+    """
+    session = requests.Session()
+    #a blocking pool with no slots would wait forever
+    policy = TransportPolicy(pool_maxsize=max(pool_size, 1), pool_block=True)
+    session.mount("https://", policy)
+    session.mount("http://", policy)
+    session.hooks['response'].append(_check_response)
+    session.headers.update({
+        "User-Agent":
+        "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:64.0) "
+        "Gecko/20100101 Firefox/64.0",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive"})
+    return session
+
+
+def connect(username:str, password:str, base_url: str = None,
+            pool_size: int = POOL_SIZE) -> None:
     """Connects to AIMS server.
 
     Args:
         username: AIMS username (e.g. 001234)
         password: AIMS password
+        base_url: The Crew Portal URL to sign on with. Defaults to
+            CONNECT_URL. Mostly useful for testing.
+        pool_size: The number of connections to keep open, which
+            should match the number of simultaneous downloads.
 
     Raises:
         requests.ConnectionError:
@@ -40,7 +282,8 @@ def connect(username:str, password:str) -> None:
         requests.HTTPError:
             Request returned unsuccessful status code.
         requests.Timeout:
-            No response from server within REQUEST_TIMEOUT seconds.
+            No response from server within the time allowed by
+            TransportPolicy.
         mytypes.CaptchaOn:
             Captcha was detected on the login page
         mytypes.LogonError:
@@ -57,43 +300,205 @@ def connect(username:str, password:str) -> None:
     access any other AIMS page. These are stored on the global
     _session object and in the global _aims_url variable respectively.
     """
-    global _session, _aims_url
-    _session = requests.Session()
-    _session.hooks['response'].append(_check_response)
-    _session.headers.update({
-        "User-Agent":
-        "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:64.0) "
-        "Gecko/20100101 Firefox/64.0"})
+    global _session, _aims_url, _navigator
+    _session = _new_session(pool_size)
+    _navigator = _RosterNavigator()
     fprint("Connecting ")
-    r = _session.get("https://connected.easyjet.com")
+    base_url = base_url or CONNECT_URL
+    r = _session.get(base_url)
     if r.text.find("g-recaptcha") != -1: raise CaptchaOn()
-    r = _session.post("https://connected.easyjet.com/my.policy",
+    r = _session.post(base_url + "/my.policy",
                {"username": username,
                 "password": password,
-                "vhost": "standard"},
-                      timeout=REQUEST_TIMEOUT)
+                "vhost": "standard"})
     del password #to help with auditing
     soup = BeautifulSoup(r.text, 'html.parser')
     url = soup.form.get("action", None)
     if not url: raise LogonError()
     saml_request = soup.input['value']
-    r = _session.post(url, {"SAMLRequest": saml_request}, timeout=REQUEST_TIMEOUT)
+    r = _session.post(url, {"SAMLRequest": saml_request})
     soup = BeautifulSoup(r.text, 'html.parser')
     url = soup.form["action"]
     saml_response = soup.input['value']
-    r = _session.post(url, {"SAMLResponse": saml_response}, timeout=REQUEST_TIMEOUT)
+    r = _session.post(url, {"SAMLResponse": saml_response})
     autologin_url = r.url + "cms/f5-h-$$/portal/cms/redirect/ecrew"
-    r = _session.get(autologin_url, timeout=REQUEST_TIMEOUT)
+    r = _session.get(autologin_url)
     _aims_url = r.url.split("wtouch.exe")[0]
     # fix for session behaviour introduced by 2019-03-14 AIMS update
     if r.text.find("Please log out and try again.") != -1:
         _session.post(_aims_url + "perinfo.exe/AjAction?LOGOUT=1",
-                      {"AjaxOperation": "0"}, timeout=REQUEST_TIMEOUT)
-        r = _session.get(autologin_url, timeout=REQUEST_TIMEOUT)
+                      {"AjaxOperation": "0"})
+        r = _session.get(autologin_url)
         _aims_url = r.url.split("wtouch.exe")[0]
     fprint(" Done\n")
 
 
+def session_state() -> dict:
+    """Return the state required to resume the current session.
+
+    Returns:
+        A picklable dictionary with the session cookies and AIMS base
+        URL, suitable for passing to resume().
+    """
+    assert _aims_url, "Must connect before calling session_state."
+    return {"cookies": _session.cookies, "aims_url": _aims_url}
+
+
+def resume(state: dict, pool_size: int = POOL_SIZE) -> Optional[str]:
+    """Resumes a session previously returned by session_state().
+
+    Args:
+        state: A dictionary returned by session_state().
+        pool_size: As for connect().
+
+    Returns:
+        If the session is still live, the HTML of the AIMS index page,
+        which is used to probe the session. If the session has expired
+        or the probe fails for any other reason, None.
+
+    On success, the global _session and _aims_url are set up as if
+    connect() had been called.
+    """
+    global _session, _aims_url, _navigator
+    session = _new_session(pool_size)
+    session.cookies.update(state["cookies"])
+    aims_url = state["aims_url"]
+    fprint("Resuming session ")
+    try:
+        r = session.get(aims_url + "perinfo.exe/index")
+    except requests.RequestException:
+        r = None
+    if (r is None or not r.url.startswith(aims_url)
+        or r.text.find(INDEX_MARKER) == -1):
+        fprint(" Expired\n")
+        return None
+    _session, _aims_url = session, aims_url
+    _navigator = _RosterNavigator()
+    fprint(" Done\n")
+    return r.text
+
+
+def _roster_days(html: str) -> Optional[Tuple[int, int]]:
+    """Return the first and last aims_day of a brief roster, if any."""
+    days = [int(X) for X in _ROSTER_DAY_RE.findall(html)]
+    return (min(days), max(days)) if days else None
+
+
+def _aims_day_date(aims_day: int) -> dt.date:
+    return dt.date(1980, 1, 1) + dt.timedelta(aims_day)
+
+
+class _RosterNavigator:
+    """Moves between brief rosters with as few requests as possible.
+
+    AIMS keeps track of which brief roster was last displayed, and its
+    schedule form can step forwards or backwards one roster at a time.
+    The form also carries a DISPLAY_DAY field, and asking for a
+    particular day jumps straight to the roster containing it. Since
+    it is not documented whether this always works, the roster that
+    comes back is checked and the navigator falls back to stepping
+    from the nearest known roster if it is not the one expected.
+
+    The HTML and the range of aims_days of every roster visited are
+    remembered for the life of the session, keyed on offset from the
+    current roster.
+    """
+
+    def __init__(self) -> None:
+        self.rosters = {} # type: Dict[int, str]
+        self.ranges = {} # type: Dict[int, Tuple[int, int]]
+        self.position = None # type: Optional[int]
+        self.jumps = True
+
+    def get(self, offset: int) -> str:
+        if offset in self.rosters:
+            return self.rosters[offset]
+        if 0 not in self.rosters:
+            self._show(0, self._post(_ROSTER_FORM))
+        #a jump is only worth trying if stepping takes more than one request
+        if (offset not in self.rosters and self.jumps
+                and (self.position is None
+                     or abs(offset - self.position) > 1)):
+            self._jump(offset)
+        if offset not in self.rosters:
+            self._step(offset)
+        return self.rosters[offset]
+
+    def _post(self, data: Dict[str, str]) -> str:
+        return _session.post(_aims_url + "perinfo.exe/schedule", data).text
+
+    def _show(self, offset: Optional[int], html: str) -> None:
+        """Record that AIMS is displaying the roster at offset."""
+        self.position = offset
+        if offset is None: return
+        self.rosters[offset] = html
+        days = _roster_days(html)
+        if days: self.ranges[offset] = days
+
+    def _target_day(self, offset: int) -> int:
+        """Estimate an aims_day in the middle of the roster at offset.
+
+        The estimate is based on the nearest roster whose range is
+        known. Rosters that start on the first of a month and end on
+        the last are assumed to be calendar months, any others to be
+        of fixed length.
+        """
+        base = min(self.ranges, key=lambda X: abs(X - offset))
+        first, last = self.ranges[base]
+        length = last - first + 1
+        start, end = _aims_day_date(first), _aims_day_date(last)
+        if start.day == 1 and (end + dt.timedelta(1)).day == 1:
+            target = start + relativedelta(months=offset - base)
+            return (target - dt.date(1980, 1, 1)).days + 14
+        return first + (offset - base) * length + length // 2
+
+    def _jump(self, offset: int) -> None:
+        if not self.ranges:
+            self.jumps = False
+            return
+        target = self._target_day(offset)
+        html = self._post(dict(_STEP_FORM, Direc="0", ORGDAY=str(target),
+                               DISPLAY_DAY=str(target)))
+        days = _roster_days(html)
+        if days and days[0] <= target <= days[1]:
+            self._show(offset, html)
+            return
+        #The jump was ignored. Work out where AIMS ended up, if possible.
+        self.jumps = False
+        self._show(next((K for K, V in self.ranges.items() if V == days),
+                        None), html)
+
+    def _step(self, offset: int) -> None:
+        if self.position is None:
+            self._show(0, self._post(_ROSTER_FORM))
+        direc, sign = ("2", 1) if offset > self.position else ("1", -1)
+        while self.position != offset:
+            self._show(self.position + sign,
+                       self._post(dict(_STEP_FORM, Direc=direc)))
+
+
+_ROSTER_FORM = {
+    "eReferrer": "touchgo.europe.easyjet.local",
+    "_flagy": "2",
+    "DoVac": "0",
+    "Oper": "1",
+    "eCrewIsLockedDuetoPendingNotifs": "0",
+}
+
+_STEP_FORM = {
+    "FltInf": "0",
+    "_flagy": "2",
+    "OtherId": "0",
+    "_NotOne": "0",
+    "ORGDAY": "0",
+    "DISPLAY_DAY": "0",
+    "CROUTE": "0",
+    "ground_code": "0",
+    "trip_switch": "0",
+    "rightClickArray": "0",
+}
+
+
 def get_brief_roster(offset: int = 0) -> str:
     """Downloads and returns the html of a  brief roster.
 
@@ -106,45 +511,31 @@ def get_brief_roster(offset: int = 0) -> str:
     Returns:
         The raw html of the brief roster is returned as a string.
 
-    Unfortunately, as far as I can tell the "brief roster"
-    functionality of AIMS can only move from one roster to either the
-    next or previous roster. This means if the absolute value of the
-    offset is greater than 1, all intermediary rosters have to be
-    downloaded. This makes the process of stepping to a distant roster
-    very slow.
+    The "brief roster" functionality of AIMS normally only moves from
+    one roster to either the next or previous roster, so reaching a
+    distant roster by stepping means downloading every roster in
+    between. To avoid this, AIMS is first asked to jump directly to a
+    day in the middle of the wanted roster; stepping is only used if
+    that does not work. Rosters are remembered for the life of the
+    session, so asking for the same roster again costs nothing.
     """
-    global _session, _aims_url
     assert _aims_url, "Must connect before calling get_brief_roster"
     fprint("Getting roster ")
-    r = _session.post(_aims_url + "perinfo.exe/schedule",
-               {
-                   "eReferrer": "touchgo.europe.easyjet.local",
-                   "_flagy": "2",
-                   "DoVac": "0",
-                   "Oper": "1",
-                   "eCrewIsLockedDuetoPendingNotifs": "0",
-               },
-                      timeout=REQUEST_TIMEOUT)
-    if offset:
-        direc = "2" if offset > 0 else "1"
-        for _ in range(abs(offset)):
-            r = _session.post(_aims_url + "perinfo.exe/schedule",
-                             {
-                                 "Direc": direc,
-                                 "FltInf": "0",
-                                 "_flagy": "2",
-                                 "OtherId": "0",
-                                 "_NotOne": "0",
-                                 "ORGDAY": "0",
-                                 "DISPLAY_DAY": "0",
-                                 "CROUTE": "0",
-                                 "ground_code": "0",
-                                 "trip_switch": "0",
-                                 "rightClickArray": "0",
-                             },
-                              timeout=REQUEST_TIMEOUT)
+    with spans.span("fetch roster"):
+        html = _navigator.get(offset)
     fprint(" Done\n")
-    return r.text
+    return html
+
+
+def forget_rosters() -> None:
+    """Forget the brief rosters remembered by get_brief_roster().
+
+    This should be called when the roster may have changed, e.g. after
+    changes have been acknowledged.
+    """
+    global _navigator
+    assert _aims_url, "Must connect before calling forget_rosters"
+    _navigator = _RosterNavigator()
 
 
 def get_trip(aims_day: str, trip: str) -> str:
@@ -167,8 +558,7 @@ def get_trip(aims_day: str, trip: str) -> str:
                         "FltInf": "1",
                         "ORGDAY": aims_day,
                         "CROUTE": trip,
-                    },
-                     timeout=REQUEST_TIMEOUT)
+                    })
     return r.text
 
 
@@ -190,8 +580,7 @@ def get_crewlist(id_: str) -> str:
     r = _session.get(_aims_url + "perinfo.exe/getlegmem",
                     params={
                         "LegInfo": id_,
-                    },
-                     timeout=REQUEST_TIMEOUT)
+                    })
     return r.text
 
 
@@ -208,5 +597,5 @@ def get_index_page() -> str:
     """
     global _session, _aims_url
     assert _aims_url, "Must connect before calling get_index_page."
-    r = _session.get(_aims_url + "perinfo.exe/index", timeout=REQUEST_TIMEOUT)
+    r = _session.get(_aims_url + "perinfo.exe/index")
     return r.text
@@ -0,0 +1,219 @@
+"""Asynchronous equivalent of the aims.access module.
+
+The functions in this module mirror those in aims.access, but are
+coroutines and keep their state in an explicit Session object rather
+than in module globals. This allows several AIMS sessions (e.g. for
+several users) to be active in a single process, and allows the
+downloads of a session to be overlapped on one event loop:
+
+    async with await connect(username, password) as session:
+        index_page, html = await asyncio.gather(
+            get_index_page(session), get_brief_roster(session))
+
+This module requires the aiohttp package.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+import aiohttp
+from bs4 import BeautifulSoup # type: ignore
+
+from aims.mytypes import *
+from aims import access
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 6.1; WOW64; rv:64.0) "
+              "Gecko/20100101 Firefox/64.0")
+
+
+class Session:
+    """An authenticated connection to AIMS.
+
+    Attributes:
+        http: The underlying aiohttp.ClientSession, which holds the
+            session cookies.
+        aims_url: The base URL of the AIMS server.
+    """
+
+    def __init__(self, http: aiohttp.ClientSession,
+                 aims_url: Optional[str] = None) -> None:
+        self.http = http
+        self.aims_url = aims_url
+
+    async def close(self) -> None:
+        await self.http.close()
+
+    async def __aenter__(self) -> "Session":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+def new_session() -> Session:
+    """Create an unauthenticated Session.
+
+    Must be called from within a running event loop.
+    """
+    return Session(aiohttp.ClientSession(
+        headers={"User-Agent": USER_AGENT},
+        timeout=aiohttp.ClientTimeout(total=access.REQUEST_TIMEOUT)))
+
+
+async def _request(session: Session, method: str, url: str,
+                   data: Optional[Dict[str, str]] = None,
+                   params: Optional[Dict[str, str]] = None
+) -> Tuple[str, str]:
+    """Make a request; raises exceptions as required.
+
+    Returns:
+        A tuple of the final URL (after redirects) and the response text.
+    """
+    async with session.http.request(method, url,
+                                    data=data, params=params) as r:
+        access.fprint(".")
+        r.raise_for_status()
+        return str(r.url), await r.text()
+
+
+async def connect(username: str, password: str,
+                  session: Optional[Session] = None,
+                  base_url: Optional[str] = None) -> Session:
+    """Connects to AIMS server.
+
+    Args:
+        username: AIMS username (e.g. 001234)
+        password: AIMS password
+        session: An unauthenticated Session to use. If None, a new
+            one is created.
+        base_url: The Crew Portal URL to sign on with. Defaults to
+            access.CONNECT_URL.
+
+    Returns:
+        An authenticated Session. The caller is responsible for
+        closing it.
+
+    Raises:
+        aiohttp.ClientConnectionError:
+            A network problem occured.
+        aiohttp.ClientResponseError:
+            Request returned unsuccessful status code.
+        asyncio.TimeoutError:
+            No response from server within access.REQUEST_TIMEOUT seconds.
+        mytypes.CaptchaOn:
+            Captcha was detected on the login page
+        mytypes.LogonError:
+            Logon failed
+
+    The sign on procedure is the same as that of access.connect().
+    """
+    if session is None:
+        session = new_session()
+    base_url = base_url or access.CONNECT_URL
+    try:
+        access.fprint("Connecting ")
+        _, text = await _request(session, "GET", base_url)
+        if text.find("g-recaptcha") != -1: raise CaptchaOn()
+        _, text = await _request(session, "POST", base_url + "/my.policy",
+                                 {"username": username,
+                                  "password": password,
+                                  "vhost": "standard"})
+        del password #to help with auditing
+        soup = BeautifulSoup(text, 'html.parser')
+        url = soup.form.get("action", None) if soup.form else None
+        if not url: raise LogonError()
+        saml_request = soup.input['value']
+        _, text = await _request(session, "POST", url,
+                                 {"SAMLRequest": saml_request})
+        soup = BeautifulSoup(text, 'html.parser')
+        url = soup.form["action"]
+        saml_response = soup.input['value']
+        url, text = await _request(session, "POST", url,
+                                   {"SAMLResponse": saml_response})
+        autologin_url = url + "cms/f5-h-$$/portal/cms/redirect/ecrew"
+        url, text = await _request(session, "GET", autologin_url)
+        session.aims_url = url.split("wtouch.exe")[0]
+        # fix for session behaviour introduced by 2019-03-14 AIMS update
+        if text.find("Please log out and try again.") != -1:
+            await _request(session, "POST",
+                           session.aims_url + "perinfo.exe/AjAction?LOGOUT=1",
+                           {"AjaxOperation": "0"})
+            url, text = await _request(session, "GET", autologin_url)
+            session.aims_url = url.split("wtouch.exe")[0]
+    except BaseException:
+        await session.close()
+        raise
+    access.fprint(" Done\n")
+    return session
+
+
+async def get_brief_roster(session: Session, offset: int = 0) -> str:
+    """Downloads and returns the html of a brief roster.
+
+    See access.get_brief_roster() for details.
+    """
+    assert session.aims_url, "Must connect before calling get_brief_roster"
+    url = session.aims_url + "perinfo.exe/schedule"
+    _, text = await _request(session, "POST", url,
+                             dict(access._ROSTER_FORM))
+    direc = "2" if offset > 0 else "1"
+    for _ in range(abs(offset)):
+        _, text = await _request(session, "POST", url,
+                                 dict(access._STEP_FORM, Direc=direc))
+    return text
+
+
+async def get_trip(session: Session, aims_day: str, trip: str) -> str:
+    """Downloads and returns the html of a trip sheet.
+
+    See access.get_trip() for details.
+    """
+    assert session.aims_url, "Must connect before calling get_trip."
+    _, text = await _request(session, "GET",
+                             session.aims_url + "perinfo.exe/schedule",
+                             params={
+                                 "FltInf": "1",
+                                 "ORGDAY": aims_day,
+                                 "CROUTE": trip,
+                             })
+    return text
+
+
+async def get_crewlist(session: Session, id_: str) -> str:
+    """Downloads and returns the html of a crewlist.
+
+    See access.get_crewlist() for details.
+    """
+    assert session.aims_url, "Must connect before calling get_crewlist."
+    _, text = await _request(session, "GET",
+                             session.aims_url + "perinfo.exe/getlegmem",
+                             params={"LegInfo": id_})
+    return text
+
+
+async def get_index_page(session: Session) -> str:
+    """Downloads and returns the AIMS index page.
+
+    See access.get_index_page() for details.
+    """
+    assert session.aims_url, "Must connect before calling get_index_page."
+    _, text = await _request(session, "GET",
+                             session.aims_url + "perinfo.exe/index")
+    return text
+
+
+async def gather_limited(limit: int, *aws) -> list:
+    """Run awaitables concurrently, at most limit at a time.
+
+    Args:
+        limit: The maximum number of awaitables to run at once.
+        aws: The awaitables, e.g. get_trip(session, aims_day, trip)
+
+    Returns:
+        A list of results in the same order as aws.
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+    async def limited(aw):
+        async with semaphore:
+            return await aw
+    return await asyncio.gather(*(limited(X) for X in aws))
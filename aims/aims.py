@@ -1,26 +1,174 @@
 #!/usr/bin/python3
 import argparse
+import cProfile
 from getpass import getpass
-import json
 import requests
 import sys
 
-from aims import access, parse, process
-from aims import roster_format, logbook_format, ical_format
+from aims import access, parse, process, session_store, cache, output, watch
+from aims import spans, stats
+from aims import roster_format, logbook_format, ical_format, json_format
 from aims.mytypes import *
 
+def _range(str_):
+    """Convert a string such as "-6:+1" to a tuple of roster offsets."""
+    try:
+        first, last = (int(X) for X in str_.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "range must be of the form FIRST:LAST, e.g. -6:+1")
+    if first > last:
+        raise argparse.ArgumentTypeError("FIRST must not be after LAST")
+    return first, last
+
+
+def _workers(str_):
+    """Convert a string to a number of fetch workers, which must be positive."""
+    try:
+        workers = int(str_)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        raise argparse.ArgumentTypeError("workers must be a positive integer")
+    return workers
+
+
+def _out(str_):
+    """Convert a string such as "ical=roster.ics" to a (format, path) tuple."""
+    format_, sep, path = str_.partition("=")
+    if not sep or not path or format_ not in output.FORMATS:
+        raise argparse.ArgumentTypeError(
+            "output must be of the form FORMAT=PATH, where FORMAT is one "
+            "of {}".format(", ".join(output.FORMATS)))
+    return format_, path
+
+
+def _join_range(argv):
+    """Allow "--range -6:+1".
+
+    argparse would otherwise take this to be a missing argument
+    followed by an unknown option.
+    """
+    argv = list(argv)
+    if '--range' in argv[:-1]:
+        i = argv.index('--range')
+        argv[i:i + 2] = ['--range=' + argv[i + 1]]
+    return argv
+
+
 def _args():
     parser = argparse.ArgumentParser(
         description='Access AIMS data from easyJet servers.')
-    parser.add_argument('format',
-                        choices=['roster', 'logbook', 'ical', 'changes', 'json'])
+    parser.add_argument('format', choices=output.FORMATS + ['changes'])
     parser.add_argument('username')
     parser.add_argument('--future', type=int)
     parser.add_argument('--past', type=int)
     parser.add_argument('--quiet', "-q", action='store_true')
     parser.add_argument('--last_ics', "-l")
     parser.add_argument('--force', '-f', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('--workers', type=_workers, default=process.FETCH_WORKERS)
+    parser.add_argument('--keep_session', '-k', action='store_true')
+    parser.add_argument('--parser', choices=parse.available_backends())
+    parser.add_argument('--verify_parse', action='store_true')
+    parser.add_argument('--base_url')
+    parser.add_argument('--range', type=_range, metavar='FIRST:LAST')
+    parser.add_argument('--out', type=_out, action='append', default=[],
+                        metavar='FORMAT=PATH')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS')
+    parser.add_argument('--stats', action='store_true')
+    parser.add_argument('--stats_json', metavar='PATH')
+    parser.add_argument('--profile', metavar='PATH')
+    parser.add_argument('--cprofile', metavar='PATH')
+    _add_policy_args(parser)
+    args = parser.parse_args(_join_range(sys.argv[1:]))
+    if args.range and (args.future or args.past):
+        parser.error('--range cannot be used with --future or --past')
+    if args.out and args.format == 'changes':
+        parser.error('--out cannot be used with the changes format')
+    return args
+
+
+def _add_policy_args(parser):
+    """Add the switches that override the trip cache retention policy."""
+    policy = cache.DEFAULT_POLICY
+    parser.add_argument('--months', type=int, default=policy.months)
+    parser.add_argument('--final_days', type=int, default=policy.final_days)
+    parser.add_argument('--max_entries', type=int, default=policy.max_entries)
+    parser.add_argument('--max_bytes', type=int, default=policy.max_bytes)
+
+
+def _policy(args) -> cache.RetentionPolicy:
+    return cache.RetentionPolicy(args.months, args.final_days,
+                                 args.max_entries, args.max_bytes)
+
+
+def _cache_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='aims cache', description='Manage the trip cache.')
+    parser.add_argument('action', choices=['prune', 'stats'])
+    _add_policy_args(parser)
+    return parser.parse_args(argv)
+
+
+def cache_main(argv):
+    args = _cache_args(argv)
+    trip_cache = cache.get_cache()
+    if args.action == "prune":
+        removed = cache.prune_cache(
+            trip_cache, _policy(args), process._is_final, force=True)
+        print("Removed {} trips".format(removed))
+    stats = cache.cache_stats(trip_cache)
+    cache.save_cache(trip_cache)
+    lookups = stats["hits"] + stats["misses"]
+    print("Entries:    {}".format(stats["entries"]))
+    print("Bytes:      {} ({} on disk)".format(stats["bytes"],
+                                               stats["file_bytes"]))
+    print("Last run:   {} hits, {} misses{}".format(
+        stats["hits"], stats["misses"],
+        ", {:.0%} hit ratio".format(stats["hits"] / lookups)
+        if lookups else ""))
+
+
+def _watch_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='aims watch',
+        description='Keep roster files up to date as AIMS changes.')
+    parser.add_argument('username')
+    parser.add_argument('--out', type=_out, action='append', required=True,
+                        metavar='FORMAT=PATH')
+    parser.add_argument('--range', type=_range, metavar='FIRST:LAST',
+                        default=(0, 0))
+    parser.add_argument('--interval', type=float, default=watch.INTERVAL)
+    parser.add_argument('--jitter', type=float, default=watch.JITTER)
+    parser.add_argument('--max_backoff', type=float,
+                        default=watch.MAX_BACKOFF)
+    parser.add_argument('--last_ics', "-l")
+    parser.add_argument('--quiet', "-q", action='store_true')
+    parser.add_argument('--workers', type=_workers, default=process.FETCH_WORKERS)
+    parser.add_argument('--base_url')
+    _add_policy_args(parser)
+    return parser.parse_args(_join_range(argv))
+
+
+def watch_main(argv):
+    args = _watch_args(argv)
+    if args.quiet: access.fprint = lambda x: None
+    #the password is kept so that the session can be replaced if AIMS
+    #expires it
+    password = getpass()
+    first, last = args.range
+    watcher = watch.Watcher(
+        lambda: access.connect(args.username, password, args.base_url,
+                               args.workers),
+        args.out, range(first, last + 1), args.workers, args.last_ics,
+        _policy(args))
+    try:
+        watcher.run(args.interval, args.jitter, args.max_backoff)
+    except AIMSException as e:
+        report_aims_failures(e)
+        sys.exit(-2)
+    except KeyboardInterrupt:
+        pass
 
 
 def report_requests_failures(e: requests.RequestException) -> None:
@@ -31,43 +179,128 @@ def report_aims_failures(e: AIMSException) -> None:
     print("\n", e.__doc__, "\n", e.str_, file=sys.stderr)
 
 
+def report_stats(args) -> None:
+    """Print and/or save the request timings and counters of the run."""
+    if not (args.stats or args.stats_json): return
+    snapshot = stats.snapshot()
+    if args.stats:
+        print("\n" + stats.table(snapshot), file=sys.stderr)
+    if args.stats_json:
+        output.write_atomic(args.stats_json, stats.dumps(snapshot) + "\n")
+
+
+def start_profiling(args) -> Optional[cProfile.Profile]:
+    """Start recording spans and/or cProfile data if asked to."""
+    if args.profile:
+        spans.enable()
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    return None
+
+
+def report_profile(args, profiler: Optional[cProfile.Profile]) -> None:
+    """Write out the data recorded since start_profiling()."""
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.profile:
+        spans.write_trace(args.profile, spans.disable())
+
+
+def _stream(pieces, sep):
+    """Write pieces of output to stdout as soon as they are produced."""
+    for i, piece in enumerate(pieces):
+        if i: sys.stdout.write(sep)
+        sys.stdout.write(piece)
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+
+
 def main():
+    if sys.argv[1:2] == ["cache"]:
+        cache_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["watch"]:
+        watch_main(sys.argv[2:])
+        return
     args = _args()
     if args.quiet: access.fprint = lambda x: None
+    parse.set_backend(args.parser)
+    parse.VERIFY_CREWLISTS = args.verify_parse
+    access.set_deadline(args.deadline)
+    if args.keep_session and not session_store.available():
+        access.fprint("--keep_session requires the cryptography package\n")
+        args.keep_session = False
+    profiler = start_profiling(args)
     try:
-        access.connect(args.username, getpass())
-        access.fprint("Checking for changes ")
-        index_page = access.get_index_page()
-        access.fprint(" Done\n")
-        no_changes_marker = '\r\nvar notification = Trim("");\r\n'
-        if index_page.find(no_changes_marker) == -1:
-            output = sys.stdout if args.format == "changes" else sys.stderr
-            print("You have changes.", file=output)
+        index_page = None
+        if args.keep_session:
+            state = session_store.load(args.username)
+            if state:
+                with spans.span("connect"):
+                    index_page = access.resume(state, args.workers)
+        if index_page is None:
+            #time spent typing the password does not count
+            remaining = access.remaining_time()
+            password = getpass()
+            access.set_deadline(remaining)
+            with spans.span("connect"):
+                access.connect(args.username, password, args.base_url,
+                               args.workers)
+            del password #to help with auditing
+            access.fprint("Checking for changes ")
+            index_page = access.get_index_page()
+            access.fprint(" Done\n")
+        if args.keep_session:
+            session_store.save(args.username, access.session_state())
+        if index_page.find(access.NO_CHANGES_MARKER) == -1:
+            stream = sys.stdout if args.format == "changes" else sys.stderr
+            print("You have changes.", file=stream)
             return
         if args.format == "changes":
             print("No changes")
             return
-        offset = 0
-        if args.future: offset = args.future
-        elif args.past: offset = -args.past
-        html = access.get_brief_roster(offset)
-        brief_roster = parse.parse_brief_roster(html)
-        dutylist = process.process_roster_entries(brief_roster, args.force)
-        if args.format == "roster":
-            print(roster_format.dump(dutylist))
+        #streamed roster output needs the duties in date order
+        sort = args.format == "roster" and not args.out
+        if args.range:
+            first, last = args.range
+            duties = process.iter_roster_periods(
+                (parse.parse_brief_roster(access.get_brief_roster(X))
+                 for X in range(first, last + 1)),
+                args.force, args.workers, sort, _policy(args))
+        else:
+            offset = 0
+            if args.future: offset = args.future
+            elif args.past: offset = -args.past
+            html = access.get_brief_roster(offset)
+            brief_roster = parse.parse_brief_roster(html)
+            duties = process.iter_duties(
+                brief_roster, args.force, args.workers, sort=sort,
+                policy=_policy(args))
+        if args.out:
+            output.render(list(duties), [(args.format, None)] + args.out,
+                          args.last_ics)
+        elif args.format == "roster":
+            _stream(roster_format.iter_dump(duties), "\n")
         elif args.format == "logbook":
-            print(logbook_format.dump(dutylist))
+            _stream(logbook_format.iter_dump(duties), "\n")
         elif args.format == "ical":
-            print(ical_format.dump(dutylist, args.last_ics))
+            dutylist = list(duties)
+            with spans.span("render ical"):
+                print(ical_format.dump(dutylist, args.last_ics))
         elif args.format == "json":
-            print(json.dumps(dutylist, sort_keys=True, indent=4,
-                  default=lambda x: x.__str__()))
+            _stream(json_format.iter_dump(duties), "")
     except requests.RequestException as e:
         report_requests_failures(e)
         sys.exit(-1)
     except AIMSException as e:
         report_aims_failures(e)
         sys.exit(-2)
+    finally:
+        report_stats(args)
+        report_profile(args, profiler)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,475 @@
+"""Persistent cache of processed trips.
+
+Trips are stored in an SQLite database, one row per trip, keyed on
+the date of the trip and its AIMS trip identifier. Rows are only read
+and written as they are needed, so the cost of a run does not depend
+on how many years of trips have accumulated.
+
+For the benefit of the rest of the program, the cache is presented as
+a dictionary with a "trips" key. The value of this key behaves like a
+dictionary mapping (date, trip_id) tuples to lists of Duty objects.
+The "sheets" key similarly maps (date, trip_id) tuples to a digest of
+the trip sheet that the duties were made from and the parsed trip
+sheet, so that a trip sheet that has not changed need not be parsed
+or processed again. The "crewlists" key maps AIMS sector identifiers
+to the crew lists of flown sectors, which do not change once a sector
+has been flown.
+
+Every change to the cache is written immediately in its own small
+transaction, so a run that is killed part way through keeps all the
+trips it had finished with. Storing a trip that has not changed does
+not write anything, so a run where every trip is found in the cache
+leaves the database untouched.
+"""
+
+import os
+import pickle
+import sqlite3
+import datetime as dt
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator
+
+from dateutil.relativedelta import relativedelta
+
+from aims.mytypes import *
+
+CACHE_DIRECTORY = os.path.expanduser("~/.cache")
+CACHE_FILE = os.path.join(CACHE_DIRECTORY, "aims.sqlite.v1")
+PICKLE_CACHE_FILE = os.path.join(CACHE_DIRECTORY, "aims.pickle.v1")
+
+TripKey = Tuple[dt.date, str]
+
+#The primary key doubles as the index on date used for range pruning,
+#since date is its leftmost column.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    date TEXT NOT NULL,
+    trip_id TEXT NOT NULL,
+    duties BLOB NOT NULL,
+    PRIMARY KEY (date, trip_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sheets (
+    date TEXT NOT NULL,
+    trip_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    aims_duties BLOB NOT NULL,
+    PRIMARY KEY (date, trip_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS crewlists (
+    sector_id TEXT PRIMARY KEY,
+    added TEXT NOT NULL,
+    crewlist BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class RetentionPolicy(NamedTuple):
+    """Rules for removing trips from the cache.
+
+    Any rule may be None to disable it.
+
+    Attributes:
+        months: Trips dated more than this many months ago are removed.
+        final_days: Trips dated more than this many days ago are
+            removed unless all their duties are finalised. AIMS will
+            not fill in the missing details at this point, so there
+            is no point repeatedly downloading the trip.
+        max_entries: If there are more trips than this, the oldest
+            are removed.
+        max_bytes: If the stored trips take more bytes than this, the
+            oldest are removed.
+    """
+    months: Optional[int] = 24
+    final_days: Optional[int] = 31
+    max_entries: Optional[int] = None
+    max_bytes: Optional[int] = None
+
+
+DEFAULT_POLICY = RetentionPolicy()
+
+
+class TripStore(MutableMapping):
+    """A dictionary-like view of the trips table."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __getitem__(self, key: TripKey) -> List[Duty]:
+        row = self.connection.execute(
+            "SELECT duties FROM trips WHERE date = ? AND trip_id = ?",
+            (key[0].isoformat(), key[1])).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key: TripKey, duties: List[Duty]) -> None:
+        params = (key[0].isoformat(), key[1])
+        blob = pickle.dumps(duties)
+        row = self.connection.execute(
+            "SELECT duties FROM trips WHERE date = ? AND trip_id = ?",
+            params).fetchone()
+        if row is not None and row[0] == blob:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO trips (date, trip_id, duties) "
+                "VALUES (?, ?, ?)", params + (blob,))
+
+    def __delitem__(self, key: TripKey) -> None:
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM trips WHERE date = ? AND trip_id = ?",
+                (key[0].isoformat(), key[1]))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[TripKey]:
+        for date, trip_id in self.connection.execute(
+                "SELECT date, trip_id FROM trips ORDER BY date").fetchall():
+            yield dt.datetime.strptime(date, "%Y-%m-%d").date(), trip_id
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM trips").fetchone()[0]
+
+    def prune(self, before: dt.date) -> int:
+        """Remove all trips dated before a given date.
+
+        Returns:
+            The number of trips removed.
+        """
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM trips WHERE date < ?",
+                (before.isoformat(),)).rowcount
+
+    def prune_unfinalised(self, before: dt.date,
+                          is_final: Callable[[List[Duty]], bool]) -> int:
+        """Remove trips dated before a given date that are not finalised.
+
+        Args:
+            before: Only trips dated before this are considered.
+            is_final: A function that returns True if a list of duties
+                is finalised.
+
+        Returns:
+            The number of trips removed.
+        """
+        rows = self.connection.execute(
+            "SELECT date, trip_id, duties FROM trips WHERE date < ?",
+            (before.isoformat(),)).fetchall()
+        doomed = [(date, trip_id) for date, trip_id, duties in rows
+                  if not is_final(pickle.loads(duties))]
+        if doomed:
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM trips WHERE date = ? AND trip_id = ?", doomed)
+        return len(doomed)
+
+    def prune_size(self, max_entries: Optional[int] = None,
+                   max_bytes: Optional[int] = None) -> int:
+        """Remove the oldest trips until the cache is small enough.
+
+        Returns:
+            The number of trips removed.
+        """
+        rows = self.connection.execute(
+            "SELECT date, trip_id, LENGTH(duties) FROM trips "
+            "ORDER BY date DESC").fetchall()
+        keep, total = 0, 0
+        for _, _, size in rows:
+            if max_entries is not None and keep >= max_entries: break
+            if max_bytes is not None and total + size > max_bytes: break
+            keep += 1
+            total += size
+        doomed = [(date, trip_id) for date, trip_id, _ in rows[keep:]]
+        if doomed:
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM trips WHERE date = ? AND trip_id = ?", doomed)
+        return len(doomed)
+
+    def size(self) -> int:
+        """Return the total number of bytes used by the stored trips."""
+        return self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(duties)), 0) FROM trips").fetchone()[0]
+
+    def get_meta(self) -> Dict[str, str]:
+        return dict(self.connection.execute(
+            "SELECT key, value FROM meta").fetchall())
+
+    def set_meta(self, **kwargs: str) -> None:
+        """Store metadata values; unchanged values are not written."""
+        meta = self.get_meta()
+        changed = [(k, str(v)) for k, v in kwargs.items()
+                   if meta.get(k) != str(v)]
+        if changed:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    changed)
+
+
+class SheetStore(MutableMapping):
+    """A dictionary-like view of the sheets table.
+
+    Values are (digest, aims_duties) tuples, where digest is a hex
+    digest of the trip sheet HTML and aims_duties is the result of
+    parsing it with parse.parse_trip_details().
+    """
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __getitem__(self, key: TripKey) -> Tuple[str, List[AimsDuty]]:
+        row = self.connection.execute(
+            "SELECT digest, aims_duties FROM sheets "
+            "WHERE date = ? AND trip_id = ?",
+            (key[0].isoformat(), key[1])).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0], pickle.loads(row[1])
+
+    def __setitem__(self, key: TripKey,
+                    value: Tuple[str, List[AimsDuty]]) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sheets "
+                "(date, trip_id, digest, aims_duties) VALUES (?, ?, ?, ?)",
+                (key[0].isoformat(), key[1], value[0],
+                 pickle.dumps(value[1])))
+
+    def __delitem__(self, key: TripKey) -> None:
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM sheets WHERE date = ? AND trip_id = ?",
+                (key[0].isoformat(), key[1]))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[TripKey]:
+        for date, trip_id in self.connection.execute(
+                "SELECT date, trip_id FROM sheets ORDER BY date").fetchall():
+            yield dt.datetime.strptime(date, "%Y-%m-%d").date(), trip_id
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sheets").fetchone()[0]
+
+    def prune_orphans(self) -> int:
+        """Remove sheets whose trip is no longer in the trips table.
+
+        Returns:
+            The number of sheets removed.
+        """
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM sheets WHERE NOT EXISTS ("
+                "SELECT 1 FROM trips WHERE trips.date = sheets.date "
+                "AND trips.trip_id = sheets.trip_id)").rowcount
+
+
+class CrewlistStore(MutableMapping):
+    """A dictionary-like view of the crewlists table.
+
+    Keys are AIMS sector identifiers, as found in the first field of an
+    AimsSector, and values are lists of Crewmember objects. The date
+    each crew list was added is recorded for pruning.
+    """
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __getitem__(self, key: str) -> List[Crewmember]:
+        row = self.connection.execute(
+            "SELECT crewlist FROM crewlists WHERE sector_id = ?",
+            (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __contains__(self, key: object) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM crewlists WHERE sector_id = ?",
+            (key,)).fetchone() is not None
+
+    def __setitem__(self, key: str, crewlist: List[Crewmember]) -> None:
+        blob = pickle.dumps(crewlist)
+        row = self.connection.execute(
+            "SELECT crewlist FROM crewlists WHERE sector_id = ?",
+            (key,)).fetchone()
+        if row is not None and row[0] == blob:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO crewlists (sector_id, added, crewlist) "
+                "VALUES (?, ?, ?)",
+                (key, dt.datetime.utcnow().date().isoformat(), blob))
+
+    def __delitem__(self, key: str) -> None:
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM crewlists WHERE sector_id = ?", (key,))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for (sector_id,) in self.connection.execute(
+                "SELECT sector_id FROM crewlists").fetchall():
+            yield sector_id
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM crewlists").fetchone()[0]
+
+    def prune(self, before: dt.date) -> int:
+        """Remove all crew lists added before a given date.
+
+        Returns:
+            The number of crew lists removed.
+        """
+        with self.connection:
+            return self.connection.execute(
+                "DELETE FROM crewlists WHERE added < ?",
+                (before.isoformat(),)).rowcount
+
+
+def _connect(filename: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(filename)
+    connection.execute("PRAGMA journal_mode=WAL")
+    #in WAL mode this is still safe if the process is killed
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _migrate(store: TripStore, pickle_file: str) -> None:
+    """Import trips from the cache used by earlier versions.
+
+    The old cache file is renamed once it has been imported, so that
+    the migration only happens once.
+    """
+    try:
+        with open(pickle_file, "rb") as f:
+            old_cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return
+    with store.connection:
+        store.connection.executemany(
+            "INSERT OR REPLACE INTO trips (date, trip_id, duties) "
+            "VALUES (?, ?, ?)",
+            [(date.isoformat(), trip_id, pickle.dumps(duties))
+             for (date, trip_id), duties in old_cache.get("trips", {}).items()])
+    os.replace(pickle_file, pickle_file + ".migrated")
+
+
+def get_cache(filename: str = None, pickle_file: str = None) -> dict:
+    """Open the trip cache.
+
+    Args:
+        filename: The SQLite database to use. Defaults to CACHE_FILE.
+        pickle_file: A cache file from an earlier version to import,
+            if it exists. Defaults to PICKLE_CACHE_FILE.
+
+    Returns:
+        A dictionary with a "trips" key, whose value is a TripStore,
+        a "sheets" key, whose value is a SheetStore, and a "crewlists"
+        key, whose value is a CrewlistStore. The cache must be passed
+        to save_cache() when finished with.
+    """
+    filename = filename or CACHE_FILE
+    pickle_file = pickle_file or PICKLE_CACHE_FILE
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    connection = _connect(filename)
+    store = TripStore(connection)
+    if os.path.exists(pickle_file):
+        _migrate(store, pickle_file)
+    return {"trips": store, "sheets": SheetStore(connection),
+            "crewlists": CrewlistStore(connection)}
+
+
+def prune_cache(dict_: dict,
+                policy: RetentionPolicy,
+                is_final: Callable[[List[Duty]], bool],
+                today: Optional[dt.date] = None,
+                force: bool = False
+) -> int:
+    """Apply a retention policy to the trip cache.
+
+    Args:
+        dict_: A cache returned by get_cache().
+        policy: The RetentionPolicy to apply.
+        is_final: A function that returns True if a list of duties is
+            finalised.
+        today: The current date. Defaults to the current UTC date.
+        force: Apply the policy even if it has already been applied
+            today.
+
+    Returns:
+        The number of trips removed.
+
+    Since checking whether trips are finalised involves loading them,
+    the policy is normally only applied once per day.
+    """
+    store = dict_["trips"]
+    today = today or dt.datetime.utcnow().date()
+    if not force and store.get_meta().get("last_prune") == today.isoformat():
+        return 0
+    removed = 0
+    if policy.months is not None:
+        removed += store.prune(today - relativedelta(months=policy.months))
+        if "crewlists" in dict_:
+            dict_["crewlists"].prune(
+                today - relativedelta(months=policy.months))
+    if policy.final_days is not None:
+        removed += store.prune_unfinalised(
+            today - dt.timedelta(days=policy.final_days), is_final)
+    if policy.max_entries is not None or policy.max_bytes is not None:
+        removed += store.prune_size(policy.max_entries, policy.max_bytes)
+    if "sheets" in dict_:
+        dict_["sheets"].prune_orphans()
+    store.set_meta(last_prune=today.isoformat())
+    return removed
+
+
+def cache_stats(dict_: dict) -> Dict[str, int]:
+    """Return statistics about the trip cache.
+
+    Returns:
+        A dictionary with the number of stored trips ("entries"), the
+        bytes they use ("bytes"), the size of the database files
+        ("file_bytes") and the cache hits and misses of the last run
+        ("hits" and "misses").
+    """
+    store = dict_["trips"]
+    filename = store.connection.execute(
+        "PRAGMA database_list").fetchone()[2]
+    file_bytes = sum(os.path.getsize(X)
+                     for X in (filename, filename + "-wal")
+                     if os.path.exists(X))
+    meta = store.get_meta()
+    return {
+        "entries": len(store),
+        "bytes": store.size(),
+        "file_bytes": file_bytes,
+        "hits": int(meta.get("hits", 0)),
+        "misses": int(meta.get("misses", 0)),
+    }
+
+
+def save_cache(dict_: dict) -> None:
+    """Close the trip cache.
+
+    If dict_ has a "last_run" key, its value should be a dictionary
+    with "hits" and "misses" counts, which are recorded for
+    cache_stats(). Trips have already been written as they were
+    stored.
+    """
+    store = dict_["trips"]
+    if "last_run" in dict_:
+        store.set_meta(**dict_["last_run"])
+    store.connection.close()
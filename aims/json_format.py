@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+
+from typing import Iterable, Iterator, List
+from aims.mytypes import *
+import json
+
+
+def _encode(duty: Duty) -> str:
+    return json.dumps(duty, sort_keys=True, indent=4,
+                      default=lambda x: x.__str__())
+
+
+def dump(dutylist: List[Duty]) -> str:
+    return "".join(iter_dump(dutylist))
+
+
+def iter_dump(duties: Iterable[Duty]) -> Iterator[str]:
+    """Yield a JSON array of duties a piece at a time.
+
+    Joining the pieces gives the same text as json.dumps() of the whole
+    list with an indent of 4, without the list having to be built.
+    """
+    first = True
+    for duty in duties:
+        yield ("[\n    " if first else ",\n    ") + _encode(duty).replace(
+            "\n", "\n    ")
+        first = False
+    yield "[]" if first else "\n]"
@@ -1,5 +1,5 @@
 
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List
 from aims.mytypes import *
 import datetime as dt
 
@@ -119,15 +119,23 @@ reg_dict = {
 
 
 def dump(dutylist: List[Duty]) -> str:
-    output = []
-    for duty in dutylist:
+    return "\n".join(iter_dump(dutylist))
+
+
+def iter_dump(duties: Iterable[Duty]) -> Iterator[str]:
+    """Yield the lines of a logbook one by one.
+
+    Duties should be supplied in date order. Iteration stops at the
+    first duty that has not yet started.
+    """
+    for duty in duties:
         if duty.on > dt.datetime.utcnow(): break
-        output.append("{:%Y-%m-%d}".format(duty.on))
+        yield "{:%Y-%m-%d}".format(duty.on)
         if not duty.sectors:
-            output.append("{:%H%M}/{:%H%M} #{}\n".format(
-                duty.on, duty.off, duty.text))
+            yield "{:%H%M}/{:%H%M} #{}\n".format(
+                duty.on, duty.off, duty.text)
             continue
-        output.append("{:%H%M}/{:%H%M}".format(duty.on, duty.off))
+        yield "{:%H%M}/{:%H%M}".format(duty.on, duty.off)
         reg = None
         crewlist = None
         for sector in duty.sectors:
@@ -135,7 +143,7 @@ def dump(dutylist: List[Duty]) -> str:
             if sector.crewlist and crewlist != sector.crewlist:
                 crewstr = ", ".join(
                     ["{}:{}".format(X.role, X.name) for X in sector.crewlist])
-                output.append(r"{{ {} }}".format(crewstr))
+                yield r"{{ {} }}".format(crewstr)
             crewlist = sector.crewlist
             sunset, sunrise = approx_night(sector.off)
             mid_duty_time = sector.off + (sector.off - sector.on) // 2
@@ -143,11 +151,10 @@ def dump(dutylist: List[Duty]) -> str:
             if mid_duty_time.time() > sunset or mid_duty_time.time() < sunrise:
                 night = " n"
             if sector.reg and reg != sector.reg:
-                output.append("{}:{}".format(
-                    sector.reg, reg_dict.get(sector.reg, "???")))
+                yield "{}:{}".format(
+                    sector.reg, reg_dict.get(sector.reg, "???"))
                 reg = sector.reg
-            output.append("{}/{} {:%H%M}/{:%H%M}{}".format(
+            yield "{}/{} {:%H%M}/{:%H%M}{}".format(
                 sector.from_, sector.to,
-                sector.off, sector.on, night))
-        output.append("")
-    return "\n".join(output)
+                sector.off, sector.on, night)
+        yield ""
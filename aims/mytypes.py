@@ -3,7 +3,7 @@ import datetime as dt
 
 class RosterEntry(NamedTuple):
     aims_day: str
-    items: List[str]
+    items: Tuple[str, ...]
 
 class Crewmember(NamedTuple):
     name: str
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import stat
+import tempfile
+from typing import List, Optional, Tuple
+
+from aims.mytypes import *
+from aims import roster_format, logbook_format, ical_format, json_format
+from aims import spans
+
+FORMATS = ['roster', 'logbook', 'ical', 'json']
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Replace the contents of a file in a single step.
+
+    The text is written to a temporary file in the same directory,
+    which is then renamed over path, so that anything reading the file
+    (e.g. a calendar program polling an iCalendar file) never sees it
+    half written.
+
+    The file keeps the permissions of the file it replaces. A new file
+    gets the permissions allowed by the umask, as it would if it were
+    opened for writing in the usual way.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=".aims.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            f.write(text)
+        #mkstemp creates the file readable by its owner only
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_umask()
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _umask() -> int:
+    #the umask can only be read by setting it
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def render(dutylist: List[Duty],
+           outputs: List[Tuple[str, Optional[str]]],
+           last_ics: Optional[str] = None
+) -> None:
+    """Render a duty list in several formats at once.
+
+    Args:
+        dutylist: The list of Duty objects to render.
+        outputs: A list of (format, path) tuples. If path is None, the
+            output is sent to stdout.
+        last_ics: Passed on to ical_format.dump().
+
+    The formats are independent of one another, so they are rendered
+    concurrently. Output is written in the order given; files are
+    replaced atomically.
+    """
+    renderers = {
+        "roster": roster_format.dump,
+        "logbook": logbook_format.dump,
+        "ical": lambda X: ical_format.dump(X, last_ics),
+        "json": json_format.dump,
+    }
+    def render_one(format_: str) -> str:
+        with spans.span("render " + format_):
+            return renderers[format_](dutylist)
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        futures = [(path, executor.submit(render_one, format_))
+                   for format_, path in outputs]
+        for path, future in futures:
+            text = future.result()
+            if path is None:
+                print(text)
+            else:
+                write_atomic(path, text + "\n")
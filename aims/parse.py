@@ -1,7 +1,47 @@
 from aims.mytypes import *
-from bs4 import BeautifulSoup # type: ignore
+from bs4 import BeautifulSoup, SoupStrainer # type: ignore
+from bs4.builder import builder_registry # type: ignore
 import re
+import functools
+import html as html_module
 import aims.access
+from aims import spans
+
+#BeautifulSoup tree builders in order of preference. html.parser is
+#part of the standard library, so is always available.
+BACKENDS = ("lxml", "html.parser")
+
+_backend = None # type: Optional[str]
+
+
+def available_backends() -> List[str]:
+    """Return the names of the usable parser backends, fastest first."""
+    return [X for X in BACKENDS if builder_registry.lookup(X)]
+
+
+def set_backend(name: Optional[str] = None) -> None:
+    """Select the HTML parser backend used by the parse functions.
+
+    Args:
+        name: One of BACKENDS, or None to use the fastest available.
+
+    Raises:
+        ValueError: The requested backend is not installed.
+    """
+    global _backend
+    if name is not None and name not in available_backends():
+        raise ValueError("Parser backend {} is not available".format(name))
+    _backend = name
+
+
+def get_backend() -> str:
+    """Return the name of the HTML parser backend currently in use."""
+    return _backend or available_backends()[0]
+
+
+def _soup(html: str, parse_only: Optional[SoupStrainer] = None
+) -> BeautifulSoup:
+    return BeautifulSoup(html, get_backend(), parse_only=parse_only)
 
 
 def parse_brief_roster(html: str) -> List[RosterEntry]:
@@ -12,12 +52,17 @@ def parse_brief_roster(html: str) -> List[RosterEntry]:
 
     Returns:
         A list of RosterEntry objects. A RosterEntry object is a tuple
-        consisting of an aims_day and a list of strings. An aims_day
+        consisting of an aims_day and a tuple of strings. An aims_day
         is an integer representing the number of elapsed days since
-        1st January 1980 that is used internally by AIMS. The list of
+        1st January 1980 that is used internally by AIMS. The tuple of
         strings is the strings that AIMS allocated to that day of the
         brief roster in reading order.
 
+    Since RosterEntry objects are immutable, the result of parsing is
+    memoised: parsing the same HTML again returns a new list of the
+    same RosterEntry objects without re-parsing, unless the parser
+    backend has been changed in the meantime.
+
     There appear to be four categories of strings published on an
     AIMS brief roster:
 
@@ -42,17 +87,20 @@ def parse_brief_roster(html: str) -> List[RosterEntry]:
     day's trip crosses midnight.
 
     """
-    soup = BeautifulSoup(html, "html.parser")
+    with spans.span("parse roster"):
+        return list(_parse_brief_roster(html, get_backend()))
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_brief_roster(html: str, backend: str) -> Tuple[RosterEntry, ...]:
+    soup = _soup(html, SoupStrainer("div", id="main_div"))
     main_div = soup.find("div", id="main_div")
     if not main_div: raise BadBriefRoster
     duties_tables = main_div.find_all("table", class_="duties_table")
     if not duties_tables: raise BadBriefRoster
-    roster_entries: List[RosterEntry] = []
-    for table in duties_tables:
-        roster_entries.append(RosterEntry(
-            table.parent["id"].replace("myday_", ""),
-            [X for X in table.stripped_strings]))
-    return roster_entries
+    return tuple(RosterEntry(table.parent["id"].replace("myday_", ""),
+                             tuple(table.stripped_strings))
+                 for table in duties_tables)
 
 
 def parse_trip_details(html:str) -> List[AimsDuty]:
@@ -101,7 +149,7 @@ def parse_trip_details(html:str) -> List[AimsDuty]:
     """
     if html.find("Unable to find the trip details") != -1:
         raise NoTripDetails
-    soup = BeautifulSoup(html, "html.parser")
+    soup = _soup(html, SoupStrainer("table"))
     first_sector = soup.find("tr", class_="mono_rows_ctrl_f3")
     if not first_sector:
         raise BadTripDetails("tr.mono_rows_ctrl_f3 not found")
@@ -123,18 +171,80 @@ def parse_trip_details(html:str) -> List[AimsDuty]:
     return aims_duties
 
 
-def parse_crewlist(html: str) -> List[Crewmember]:
+#If True, crew lists are always checked against a full parse
+VERIFY_CREWLISTS = False
+
+_crew_header_re = re.compile(
+    r"""<tr\b[^>]*\bclass=["']?(?:[^"'>]*\s)?sub_table_header(?=["'\s>])""",
+    re.IGNORECASE)
+_crew_row_re = re.compile(r"<tr\b", re.IGNORECASE)
+_crew_cell_re = re.compile(r"<td\b[^>]*>(.*?)</td>",
+                           re.IGNORECASE | re.DOTALL)
+_tag_re = re.compile(r"<[^>]*>")
+
+
+def parse_crewlist(html: str, verify: Optional[bool] = None
+) -> List[Crewmember]:
     """Convert an AIMS HTML crew list into a crew list.
 
     Args:
         html: The HTML of the AIMS crew list.
+        verify: If True, the result of the fast parser is checked
+            against the result of a full parse. Defaults to
+            VERIFY_CREWLISTS.
 
     Returns:
         A list of Crewmember objects. A Crewmember object is a named
         tuple consisting of a name and a role.
+
+    Crew lists are parsed by scanning the rows of the crew table with
+    regular expressions, since only three cells of each row are of
+    interest. If the fast parser cannot make sense of the HTML, a full
+    parse is done instead. In verify mode any difference between the
+    two parsers is reported, since it is likely to indicate that AIMS
+    has changed its markup, and the full parse result is used.
+    """
+    if verify is None: verify = VERIFY_CREWLISTS
+    crewlist = _fast_parse_crewlist(html)
+    if crewlist is None or verify:
+        full_crewlist = _full_parse_crewlist(html)
+        if crewlist is not None and crewlist != full_crewlist:
+            aims.access.fprint("\nFast crew list parse mismatch: {} != {}\n"
+                               .format(crewlist, full_crewlist))
+        crewlist = full_crewlist
+    return crewlist
+
+
+def _fast_parse_crewlist(html: str) -> Optional[List[Crewmember]]:
+    """Parse a crew list with regular expressions.
+
+    Returns:
+        A list of Crewmember objects, or None if the HTML does not
+        have the expected structure.
     """
+    header = _crew_header_re.search(html)
+    if not header: return None
+    end = html.find("</table>", header.end())
+    if end == -1: return None
+    #first chunk is the remainder of the header row
+    rows = _crew_row_re.split(html[header.end():end])[1:]
+    crewlist = []
+    for row in rows:
+        cells = _crew_cell_re.findall(row)
+        if len(cells) < 9: return None
+        if _cell_text(cells[8]) == "*": continue #ignore positioning crew
+        crewlist.append(Crewmember(_cell_text(cells[1]).title(),
+                                   _cell_text(cells[5])))
+    return crewlist
+
+
+def _cell_text(cell: str) -> str:
+    return html_module.unescape(_tag_re.sub("", cell))
+
+
+def _full_parse_crewlist(html: str) -> List[Crewmember]:
     html = html.replace("\n</tr><tr class=", "\n<tr class=") #fix buggy html
-    soup = BeautifulSoup(html, "html.parser")
+    soup = _soup(html)
     header = soup.find("tr", class_="sub_table_header")
     if not header:
         raise BadCrewList
@@ -1,157 +1,636 @@
+import hashlib
 import re
-import os
-import pickle
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, MutableMapping, Union
+
+import requests
 
 from aims.mytypes import *
-from aims import access, parse
+from aims import access, parse, spans, stats
+from aims.cache import get_cache, save_cache, prune_cache
+from aims.cache import DEFAULT_POLICY, RetentionPolicy
 
-CACHE_DIRECTORY = os.path.expanduser("~/.cache")
-CACHE_FILE = os.path.join(CACHE_DIRECTORY, "aims.pickle.v1")
+#Number of simultaneous requests made to AIMS when fetching trip
+#sheets. Kept small so that we are no harder on the server than a
+#browser with a few tabs open.
+FETCH_WORKERS = 4
 
-def get_cache() -> dict:
-    try:
-        os.mkdir(CACHE_DIRECTORY)
-    except FileExistsError:
-        pass
-    try:
-        with open(CACHE_FILE, "rb") as cachefile:
-            return pickle.load(cachefile)
-    except OSError:
-        return {"trips": {}}
+#Number of roster entries whose trips are resolved together by
+#iter_duties(). Large enough to keep FETCH_WORKERS busy, small enough
+#that the first duties are produced quickly.
+WINDOW_DAYS = 14
+
+#A flown sector is not checked for actual times until this long after
+#its scheduled on time, since AIMS takes a while to fill them in...
+GRACE = dt.timedelta(minutes=30)
+#...and is no longer checked this long after it, since by then AIMS
+#never will.
+GIVE_UP = dt.timedelta(days=7)
+
+NON_DUTY_CODES = ("==>", "D/O", "D/OR", "WD/O", "P/T",
+                  "LVE", "FTGD", "REST", "SICK")
+
+TripRef = Tuple[str, str, dt.date] #(aims_day, trip_id, date)
 
+#Classifies a trailing field of an AimsSector in one pass: group 1
+#matches an actual time, e.g. A0630, otherwise a match is a
+#registration, e.g. G-EZBC.
+_FIELD_RE = re.compile(r"(A\d{4})|\w{1,2}-\w{3,5}")
 
-def save_cache(dict_: dict) -> None:
-    with open(CACHE_FILE, "wb") as cachefile:
-        pickle.dump(dict_, cachefile)
+_ONE_DAY = dt.timedelta(days=1)
+_HALF_DAY = _ONE_DAY / 2
 
+_DIGITS = "0123456789"
 
-def process_roster_entries(entries: List[RosterEntry], force: bool = False
+#Caches for _hhmm() and _h_mm()
+_hhmm_times = {} # type: Dict[str, dt.time]
+_h_mm_times = {} # type: Dict[str, dt.time]
+
+
+def process_roster_entries(entries: List[RosterEntry], force: bool = False,
+                           workers: int = FETCH_WORKERS,
+                           policy: RetentionPolicy = DEFAULT_POLICY
 ) -> List[Duty]:
     """Convert a list of RosterEntry objects into a list of Duty objects.
 
     Args:
         entries: A list of RosterEntry objects.
         force: Force cache update
+        workers: The maximum number of pages to download
+            simultaneously.
+        policy: The RetentionPolicy the trip cache is pruned with.
 
     Returns:
         A list of Duty objects. There may be multiple Duty objects
         associated with each RosterEntry.
+
+    See iter_duties() for details.
     """
-    duty_list = []
-    trip_cache = get_cache()
+    return list(iter_duties(entries, force, workers, policy=policy))
+
+
+def iter_duties(entries: Iterable[RosterEntry], force: bool = False,
+                workers: int = FETCH_WORKERS, window: int = WINDOW_DAYS,
+                sort: bool = False,
+                policy: RetentionPolicy = DEFAULT_POLICY
+) -> Iterator[Duty]:
+    """Convert RosterEntry objects into Duty objects as they are resolved.
+
+    Args:
+        entries: An iterable of RosterEntry objects in date order.
+        force: Force cache update
+        workers: The maximum number of pages to download
+            simultaneously.
+        window: The number of entries whose trips are resolved
+            together.
+        sort: Sort the duties of each entry by start time.
+        policy: The RetentionPolicy the trip cache is pruned with once
+            all the duties have been produced.
+
+    Returns:
+        An iterator over Duty objects. The entries are taken in order,
+        but the duties of an entry are produced from its last item to
+        its first, as process_roster_entries() has always returned
+        them, unless sort is True. Sorted duties are in date order, as
+        required by roster_format.iter_dump().
+
+    The entries are taken a window at a time. The window is scanned
+    for trips, and these are resolved together by refresh_trips(). The
+    entries of the window are then walked again in order, and their
+    duties yielded before the next window is started. Only one window
+    of entries and trips is held in memory at once.
+    """
+    yield from _cached(lambda trip_cache: _resolve_duties(
+        entries, trip_cache, force, workers, window, sort), policy)
+
+
+def _cached(duties: Callable[[dict], Iterator[Duty]],
+            policy: RetentionPolicy) -> Iterator[Duty]:
+    """Open the trip cache and yield the duties from duties(trip_cache).
+
+    The cache is pruned with policy once all the duties have been
+    yielded, and is closed however the iteration ends.
+    """
+    with spans.span("open cache"):
+        trip_cache = get_cache()
+    try:
+        yield from duties(trip_cache)
+        with spans.span("prune cache"):
+            prune_cache(trip_cache, policy, _is_final)
+    finally:
+        with spans.span("close cache"):
+            save_cache(trip_cache)
+
+
+def _resolve_duties(entries: Iterable[RosterEntry], trip_cache: dict,
+                    force: bool, workers: int, window: int, sort: bool
+) -> Iterator[Duty]:
+    """Yield the duties of entries, as described for iter_duties()."""
     access.fprint("Processing roster ")
-    for entry in entries:
-        date = (dt.datetime(1980, 1, 1) +
-                dt.timedelta(int(entry.aims_day))).date()
-        while len(entry.items):
-            p = entry.items.pop()
-            if p in ("==>", "D/O", "D/OR", "WD/O", "P/T",
-                     "LVE", "FTGD", "REST", "SICK"):
-                continue
-            elif len(p) >= 4 and p[-3] == ":":
-                end_time = dt.datetime.strptime(p, "%H:%M").time()
-                start_time = dt.datetime.strptime(entry.items.pop(), "%H:%M").time()
-                text = entry.items.pop()
-                start, end = [dt.datetime.combine(date, X)
-                              for X in (start_time, end_time)]
-                if end < start:
-                    end += dt.timedelta(days=1)
-                duty_list.append(Duty(start, end, text, None))
-            else:
-                try:
-                    duties = get_trip_duties(entry.aims_day, p, date, trip_cache, force)
-                    duty_list.extend(duties)
-                except AIMSException as e:
-                    access.fprint("\nError while processing {} on {}\n".format(
-                        p, entry.aims_day))
-                    access.fprint("{} {}\n".format(e.__doc__, e.str_))
+    last_duty = None # type: Optional[Duty]
+    for chunk in _windows(entries, window):
+        trips = [] # type: List[TripRef]
+        for entry in chunk:
+            date = _aims_date(entry.aims_day)
+            trips.extend((entry.aims_day, X, date)
+                         for X in _entry_items(entry, date)
+                         if isinstance(X, str))
+        with spans.span("resolve trips"):
+            trip_duties = refresh_trips(trips, trip_cache, force, workers)
+        for entry in chunk:
+            date = _aims_date(entry.aims_day)
+            entry_duties = []
+            for item in _entry_items(entry, date):
+                if isinstance(item, Duty):
+                    duties = [item]
+                else:
+                    duties = trip_duties.get((date, item), [])
+                #AIMS sometimes records duties with times in the
+                #detailed roster, then adds a trip that records the
+                #same duties. Since the items of an entry are walked
+                #from last to first, this means that duties that are
+                #wholly contained by the previous filtered duty should
+                #be dropped.
+                for duty in duties:
+                    if (last_duty is None or duty.on < last_duty.on
+                        or duty.off > last_duty.off):
+                        entry_duties.append(duty)
+                        last_duty = duty
+            yield from sorted(entry_duties) if sort else entry_duties
     access.fprint(" Done\n")
-    save_cache(trip_cache)
-    #AIMS sometimes records duties with times in the detailed roster,
-    #then adds a trip that records the same duties. Since we're
-    #popping duties off a stack, this means that duties that are
-    #wholly contained by the previous filtered duty should be dropped.
-    filtered_dutylist = []
-    if duty_list:
-        filtered_dutylist.append(duty_list[0])
-        for duty in duty_list[1:]:
-            last_duty = filtered_dutylist[-1]
-            if duty.on < last_duty.on or duty.off > last_duty.off:
-                filtered_dutylist.append(duty)
-    return filtered_dutylist
-
-
-def get_trip_duties(aims_day: str,
-                    trip_id: str,
-                    date: dt.date,
-                    cache: dict,
-                    force: bool = False
+
+
+def _windows(entries: Iterable[RosterEntry], size: int
+) -> Iterator[List[RosterEntry]]:
+    """Split an iterable of entries into lists of up to size entries."""
+    chunk = [] # type: List[RosterEntry]
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process_roster_periods(periods: Iterable[List[RosterEntry]],
+                           force: bool = False,
+                           workers: int = FETCH_WORKERS,
+                           policy: RetentionPolicy = DEFAULT_POLICY
 ) -> List[Duty]:
-    """Given a date and tripid, return a list of Duty objects.
+    """Convert several brief rosters into a single list of Duty objects.
+
+    See iter_roster_periods() for details.
+    """
+    return list(iter_roster_periods(periods, force, workers, policy=policy))
+
+
+def iter_roster_periods(periods: Iterable[List[RosterEntry]],
+                        force: bool = False,
+                        workers: int = FETCH_WORKERS,
+                        sort: bool = False,
+                        policy: RetentionPolicy = DEFAULT_POLICY
+) -> Iterator[Duty]:
+    """Convert several brief rosters into a single stream of Duty objects.
 
     Args:
-        aims_day: A date in the form of the number of days since 1st
-            Jan 1980.
-        trip_id: An AIMS trip identifier (e.g. B1234s)
-        date: aims_day converted to a date object
+        periods: An iterable of lists of RosterEntry objects, one list
+            per roster period, in chronological order. Each list is
+            processed as soon as it is produced, so this may be a
+            generator that downloads the rosters one by one.
+        force: Force cache update
+        workers: The maximum number of pages to download
+            simultaneously.
+        sort, policy: See iter_duties().
+
+    Returns:
+        An iterator over Duty objects covering all the periods.
+
+    Days that appear on more than one roster are only processed the
+    first time they are seen. A trip that crosses from one roster into
+    the next is processed with the roster it starts on, the following
+    roster only showing continuation markers for it. Any duty of a
+    later roster that ends before the end of the duties already
+    yielded is therefore a duplicate, and is dropped.
+    """
+    #the cache is opened once for all the periods, so that the hits and
+    #misses recorded for the run cover all of them
+    yield from _cached(lambda trip_cache: _resolve_periods(
+        periods, trip_cache, force, workers, sort), policy)
+
+
+def _resolve_periods(periods: Iterable[List[RosterEntry]], trip_cache: dict,
+                     force: bool, workers: int, sort: bool
+) -> Iterator[Duty]:
+    """Yield the duties of periods, as described for iter_roster_periods()."""
+    seen_days = set()
+    covered = None # type: Optional[dt.datetime]
+    for entries in periods:
+        entries = [X for X in entries if X.aims_day not in seen_days]
+        if not entries: continue
+        seen_days.update(X.aims_day for X in entries)
+        period_covered = covered
+        for duty in _resolve_duties(entries, trip_cache, force, workers,
+                                    WINDOW_DAYS, sort):
+            if period_covered is None or duty.off > period_covered:
+                covered = duty.off if covered is None else max(covered,
+                                                               duty.off)
+                yield duty
+
+
+def _aims_date(aims_day: str) -> dt.date:
+    """Convert an aims_day string into a date object."""
+    return (dt.datetime(1980, 1, 1) + dt.timedelta(int(aims_day))).date()
+
+
+def _entry_items(entry: RosterEntry, date: dt.date
+) -> Iterator[Union[Duty, str]]:
+    """Classify the items of a RosterEntry.
+
+    Args:
+        entry: The RosterEntry to classify.
+        date: entry.aims_day converted to a date object
+
+    Returns:
+        An iterator that yields a Duty object for each standby or
+        training duty and a trip identifier for each trip. Day off
+        codes and continuation markers are dropped. Items are yielded
+        in reverse order, i.e. the order they would be popped off the
+        end of entry.items. The items are scanned by index, so entry
+        is not modified and may be processed any number of times.
+    """
+    items = entry.items
+    i = len(items)
+    while i:
+        i -= 1
+        p = items[i]
+        if p in NON_DUTY_CODES:
+            continue
+        elif len(p) >= 4 and p[-3] == ":":
+            if i < 2:
+                raise IndexError("Incomplete duty in {}".format(entry))
+            end_time = _h_mm(p)
+            start_time = _h_mm(items[i - 1])
+            text = items[i - 2]
+            i -= 2
+            start, end = [dt.datetime.combine(date, X)
+                          for X in (start_time, end_time)]
+            if end < start:
+                end += dt.timedelta(days=1)
+            yield Duty(start, end, text, None)
+        else:
+            yield p
+
+
+def _fetch_concurrently(fetch: Callable[..., str],
+                        args_list: List[tuple],
+                        workers: int = FETCH_WORKERS,
+                        return_exceptions: bool = False
+) -> List[Union[str, requests.RequestException]]:
+    """Call fetch(*args) for each entry of args_list using a thread pool.
+
+    Args:
+        fetch: A function that downloads a page and returns its HTML.
+        args_list: A list of argument tuples for fetch.
+        workers: The maximum number of simultaneous calls.
+        return_exceptions: If True, a requests.RequestException raised
+            by fetch is returned in place of the HTML rather than
+            raised.
+
+    Returns:
+        A list of the HTML strings returned by fetch, in the same order
+        as args_list. Unless return_exceptions is True, the first
+        exception raised by fetch is re-raised.
+    """
+    if return_exceptions:
+        fetch = _returning_exceptions(fetch)
+    if workers <= 1 or len(args_list) <= 1:
+        return [fetch(*X) for X in args_list]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda X: fetch(*X), args_list))
+
+
+def _returning_exceptions(fetch: Callable[..., str]
+) -> Callable[..., Union[str, requests.RequestException]]:
+    def wrapper(*args):
+        try:
+            return fetch(*args)
+        except requests.RequestException as e:
+            return e
+    return wrapper
+
+
+def fetch_trip_sheets(trips: List[TripRef], workers: int = FETCH_WORKERS,
+                      return_exceptions: bool = False
+) -> Dict[Tuple[dt.date, str], Union[str, requests.RequestException]]:
+    """Concurrently download the trip sheets for a list of trips.
+
+    Args:
+        trips: A list of (aims_day, trip_id, date) tuples. Duplicates
+            are only downloaded once.
+        workers: The maximum number of simultaneous downloads.
+        return_exceptions: See _fetch_concurrently().
+
+    Returns:
+        A dictionary mapping (date, trip_id) keys to trip sheet HTML,
+        or to the exception raised if return_exceptions is True and
+        the download failed.
+    """
+    unique = list(dict.fromkeys(trips))
+    with spans.span("fetch trip sheets"):
+        sheets = _fetch_concurrently(
+            access.get_trip, [(X[0], X[1]) for X in unique], workers,
+            return_exceptions)
+    return {(X[2], X[1]): html for X, html in zip(unique, sheets)}
+
+
+def refresh_trips(trips: List[TripRef],
+                  cache: dict,
+                  force: bool = False,
+                  workers: int = FETCH_WORKERS
+) -> Dict[Tuple[dt.date, str], List[Duty]]:
+    """Given a list of trips, return the Duty objects for each of them.
+
+    Args:
+        trips: A list of (aims_day, trip_id, date) tuples, where
+            aims_day is a date in the form of the number of days since
+            1st Jan 1980, trip_id is an AIMS trip identifier
+            (e.g. B1234s) and date is aims_day converted to a date
+            object.
         cache: A dictionary with a "trips" key that a dutylist can be
             cached in.
         force: If True, do not load trip details from cache
+        workers: The maximum number of pages to download
+            simultaneously.
 
     Returns:
-        A list of Duty objects.
+        A dictionary mapping (date, trip_id) keys to lists of Duty
+        objects. Trips that could not be processed are missing.
+
+    This function also handles caching of the duties associated with
+    trips. Trips that require updating are processed in stages: all
+    their trip sheets are downloaded, then parsed, then the crew lists
+    of all flown sectors are downloaded and finally the sectors are
+    processed. Downloads are done concurrently.
+
+    A digest of each trip sheet is cached along with the parsed sheet.
+    If a downloaded trip sheet is identical to the one the cached
+    duties were made from, the cached duties are used as they are. If
+    a trip sheet has changed, crew lists are only downloaded for
+    sectors that are new or whose actual times have changed. Neither
+    shortcut is taken if force is True.
 
-    This function also handles caching of the duties associated with trips.
+    Crew lists of flown sectors are also cached by sector identifier
+    in the "crewlists" key of cache, if present, and are not
+    downloaded again unless force is True.
+
+    If a trip cannot be downloaded or processed, the error is reported
+    and its cached duties, if any, are used even if they are out of
+    date, so that one failure does not spoil the whole run.
     """
-    cache_key = (date, trip_id)
-    duty_list = []
-    cached_duties = cache["trips"].get(cache_key)
-    if force or _requires_update(cached_duties):
-        html = access.get_trip(aims_day, trip_id)
+    trip_duties = {}
+    stale = [] # type: List[TripRef]
+    for aims_day, trip_id, date in dict.fromkeys(trips):
+        with spans.span("read cache"):
+            cached_duties = cache["trips"].get((date, trip_id))
+        if force or _requires_update(cached_duties):
+            stale.append((aims_day, trip_id, date))
+        else:
+            trip_duties[(date, trip_id)] = cached_duties
+    last_run = cache.setdefault("last_run", {"hits": 0, "misses": 0})
+    last_run["hits"] += len(trip_duties)
+    last_run["misses"] += len(stale)
+    stats.count("trip_cache_hits", len(trip_duties))
+    stats.count("trip_cache_misses", len(stale))
+    sheets = cache.setdefault("sheets", {})
+    crew_cache = cache.setdefault("crewlists", {})
+    trip_sheets = fetch_trip_sheets(stale, workers, True)
+    aims_trips = [] # type: List[Tuple[TripRef, str, List[AimsDuty]]]
+    known_crew = {} # type: Dict[str, List[Crewmember]]
+    def fail(aims_day: str, trip_id: str, date: dt.date, e: Exception
+    ) -> None:
+        duties = cache["trips"].get((date, trip_id))
+        _report_trip_failure(aims_day, trip_id, e, bool(duties))
+        stats.count("trip_failures")
+        if duties:
+            stats.count("stale_trips_used")
+            trip_duties[(date, trip_id)] = duties
+    for aims_day, trip_id, date in stale:
+        key = (date, trip_id)
+        html = trip_sheets[key]
+        if isinstance(html, requests.RequestException):
+            fail(aims_day, trip_id, date, html)
+            continue
+        digest = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        prior = None if force else sheets.get(key)
+        cached_duties = None if force else cache["trips"].get(key)
+        if prior and prior[0] == digest:
+            stats.count("unchanged_sheets")
+            if cached_duties:
+                trip_duties[key] = cached_duties
+                continue
+            aims_duties = prior[1]
+        else:
+            try:
+                with spans.span("parse trip sheet"):
+                    aims_duties = parse.parse_trip_details(html)
+            except NoTripDetails:
+                #if we get here, we tried to find a trip that
+                #didn't exist. That probably means that our
+                #list of day off codes is incomplete. Ho hum.
+                access.fprint("\nNo trip details for {}:{}\n".format(
+                    aims_day, trip_id))
+                continue
+            except AIMSException as e:
+                fail(aims_day, trip_id, date, e)
+                continue
+            if prior and cached_duties:
+                known_crew.update(_unchanged_crewlists(
+                    prior[1], cached_duties, aims_duties))
+        aims_trips.append(((aims_day, trip_id, date), digest, aims_duties))
+    crew_ids = [id_ for _, _, aims_duties in aims_trips
+                for id_ in _crewlist_ids(aims_duties)]
+    crew_pages = fetch_crewlists(
+        [id_ for id_ in crew_ids
+         if id_ not in known_crew and (force or id_ not in crew_cache)],
+        workers, True) # type: Dict[str, Any]
+    stats.count("crewlist_cache_hits", len(set(crew_ids)) - len(crew_pages))
+    crew_errors = {K: V for K, V in crew_pages.items()
+                   if isinstance(V, requests.RequestException)}
+    for id_ in crew_errors:
+        del crew_pages[id_]
+    crew_pages.update(known_crew)
+    for (aims_day, trip_id, date), digest, aims_duties in aims_trips:
         try:
-            aims_duties = parse.parse_trip_details(html)
-            duties = [process_aims_duty(X, date, trip_id)
-                      for X in aims_duties]
-            duty_list.extend(duties)
-            cache["trips"][cache_key] = duties
-        except NoTripDetails:
-            #if we get here, we tried to find a trip that
-            #didn't exist. That probably means that our
-            #list of day off codes is incomplete. Ho hum.
-            access.fprint("\nNo trip details for {}:{}\n".format(
-                aims_day, trip_id))
-    else:
-        duty_list.extend(cache["trips"][cache_key])
-    return duty_list
+            for id_ in _crewlist_ids(aims_duties):
+                if id_ in crew_errors: raise crew_errors[id_]
+            with spans.span("process trip"):
+                duties = [process_aims_duty(X, date, trip_id, crew_pages,
+                                            crew_cache)
+                          for X in aims_duties]
+            with spans.span("write cache"):
+                cache["trips"][(date, trip_id)] = duties
+                #only once the duties are stored, so that a sheet whose
+                #processing failed is processed again next time
+                sheets[(date, trip_id)] = (digest, aims_duties)
+            trip_duties[(date, trip_id)] = duties
+        except (AIMSException, requests.RequestException) as e:
+            fail(aims_day, trip_id, date, e)
+    return trip_duties
 
 
-def _requires_update(duties: Optional[List[Duty]]) -> bool:
-    """Check whether cached duties are valid.
+def _unchanged_crewlists(old_aims_duties: List[AimsDuty],
+                         old_duties: List[Duty],
+                         aims_duties: List[AimsDuty]
+) -> Dict[str, List[Crewmember]]:
+    """Find crew lists that need not be downloaded again.
 
     Args:
-        duties: The list of duties to check. Can be None.
+        old_aims_duties: A previous version of a parsed trip sheet.
+        old_duties: The duties that were made from old_aims_duties.
+        aims_duties: The current version of the parsed trip sheet.
 
     Returns:
-        True if the duties require updating, otherwise False.
+        A dictionary mapping the sector identifiers of sectors in
+        aims_duties to crew lists from old_duties, for sectors that
+        have the same identifier and actual times in both versions.
+    """
+    old = {}
+    for aims_duty, duty in zip(old_aims_duties, old_duties):
+        for aims_sector, sector in zip(aims_duty, duty.sectors or []):
+            if len(aims_sector) < 6 or not sector.crewlist: continue
+            off, on, _, _ = _classify_fields(aims_sector[6:])
+            old[aims_sector[0]] = (off, on, sector.crewlist)
+    unchanged = {}
+    for aims_duty in aims_duties:
+        for aims_sector in aims_duty:
+            if len(aims_sector) < 6 or aims_sector[0] not in old: continue
+            off, on, _, _ = _classify_fields(aims_sector[6:])
+            old_off, old_on, crewlist = old[aims_sector[0]]
+            if (off, on) == (old_off, old_on):
+                unchanged[aims_sector[0]] = crewlist
+    return unchanged
+
+
+def _report_trip_failure(aims_day: str, trip_id: str, e: Exception,
+                         stale: bool = False) -> None:
+    access.fprint("\nError while processing {} on {}\n".format(
+        trip_id, aims_day))
+    access.fprint("{} {}\n".format(
+        e.__doc__, e.str_ if isinstance(e, AIMSException) else e))
+    if stale:
+        access.fprint("Using cached details, which may be out of date\n")
+
+
+def fetch_crewlists(ids: List[str], workers: int = FETCH_WORKERS,
+                    return_exceptions: bool = False
+) -> Dict[str, Union[str, requests.RequestException]]:
+    """Concurrently download a number of crew lists.
+
+    Args:
+        ids: A list of sector identifiers, as described in the
+            documentation for access.get_crewlist(). Duplicates are
+            only downloaded once.
+        workers: The maximum number of simultaneous downloads.
+        return_exceptions: See _fetch_concurrently().
+
+    Returns:
+        A dictionary mapping sector identifiers to crew list HTML, or
+        to the exception raised if return_exceptions is True and the
+        download failed.
+    """
+    unique = list(dict.fromkeys(ids))
+    with spans.span("fetch crew lists"):
+        pages = _fetch_concurrently(
+            access.get_crewlist, [(X,) for X in unique], workers,
+            return_exceptions)
+    return dict(zip(unique, pages))
+
+
+def _crewlist_ids(aims_duties: List[AimsDuty]) -> Iterator[str]:
+    """Find the sectors of a trip that require a crew list.
+
+    Args:
+        aims_duties: A list of AimsDuty objects, as returned by
+            parse.parse_trip_details().
+
+    Returns:
+        An iterator over the sector identifiers of all sectors that
+        process_aims_sector() will attach a crew list to.
+    """
+    for aims_duty in aims_duties:
+        for aims_sector in aims_duty:
+            if len(aims_sector) < 6: continue
+            off, on, reg, pax = _classify_fields(aims_sector[6:])
+            if on and not pax:
+                yield aims_sector[0]
+
+
+def _is_stale(duties: Optional[List[Duty]],
+              now: Optional[dt.datetime] = None,
+              grace: dt.timedelta = GRACE,
+              give_up: Optional[dt.timedelta] = GIVE_UP
+) -> bool:
+    """Check whether any sector of a cached trip is still missing actuals.
+
+    Args:
+        duties: The cached duties of a trip. Can be None.
+        now: The current UTC time. Defaults to the actual time.
+        grace: Sectors are not stale until this long after their
+            scheduled on time.
+        give_up: Sectors are no longer stale this long after their
+            scheduled on time. None means never give up.
+
+    Returns:
+        True if the trip is not cached or has a stale sector.
     """
     if not duties: return True
-    now = dt.datetime.utcnow()
+    now = now or dt.datetime.utcnow()
     for duty in duties:
-        if not duty.sectors: continue
+        if not duty.sectors or duty.on >= now: continue
         for sector in duty.sectors:
-            is_final = ((sector.off and sector.on) #have actual times
-                or (sector.pax and not sector.reg) #ground positioning
-                or (sector.flightnum[0] == "["))  #quasi sector
-            if not is_final and duty.on < now:
-                return True
+            if _is_final_sector(sector): continue
+            if sector.sched_on + grace > now: continue
+            if give_up is not None and sector.sched_on + give_up < now:
+                continue
+            return True
     return False
 
 
+def _is_final_sector(sector: Sector) -> bool:
+    return bool((sector.off and sector.on) #have actual times
+                or (sector.pax and not sector.reg) #ground positioning
+                or (sector.flightnum[0] == "[")) #quasi sector
+
+
+def _requires_update(duties: Optional[List[Duty]]) -> bool:
+    """Check whether cached duties are valid.
+
+    Args:
+        duties: The list of duties to check. Can be None.
+
+    Returns:
+        True if the duties require updating, otherwise False.
+    """
+    return _is_stale(duties)
+
+
+def _is_final(duties: List[Duty]) -> bool:
+    """Check whether AIMS has finished filling in a list of duties.
+
+    Unlike _requires_update(), sectors that have been given up on are
+    not considered final.
+    """
+    return not _is_stale(duties, grace=dt.timedelta(), give_up=None)
+
+
 def process_aims_duty(
         aims_duty: List[AimsSector],
         start_date: dt.date,
-        trip_id: str
+        trip_id: str,
+        crew_pages: Optional[Dict[str, Union[str, List[Crewmember]]]] = None,
+        crew_cache: Optional[MutableMapping[str, List[Crewmember]]] = None
 ) -> Duty:
     """Create a Duty object from a list of AimsSector objects.
 
@@ -160,6 +639,10 @@ def process_aims_duty(
             parse.parse_trip_details() documentation.
         start_date: The date of the duty.
         trip_id: The id of the trip that the duty belongs to.
+        crew_pages: Previously downloaded crew lists, as described in
+            the documentation for process_aims_sector().
+        crew_cache: A cache of crew lists, as described in the
+            documentation for process_aims_sector().
 
     Returns:
         A Duty object.
@@ -168,10 +651,11 @@ def process_aims_duty(
         trip_day = int(aims_duty[0][7]) - 1
         date = start_date + dt.timedelta(days=trip_day)
         #fix for AIMS bug where end of duty can have non-existent time 24:00
-        if aims_duty[-1][-1] == "24:00": aims_duty[-1][-1] = "00:00"
-        duty_end_time = dt.datetime.strptime(aims_duty[-1][-1], "%H:%M").time()
+        end = aims_duty[-1][-1]
+        if end == "24:00": end = "00:00"
+        duty_end_time = _h_mm(end)
         index = -2 if len(aims_duty) == 1 else -1
-        duty_start_time = dt.datetime.strptime(aims_duty[0][index], "%H:%M").time()
+        duty_start_time = _h_mm(aims_duty[0][index])
     except:
         raise BadAIMSDuty(str(aims_duty))
     assert type(start_date) == dt.date
@@ -182,17 +666,29 @@ def process_aims_duty(
         duty_end += dt.timedelta(days=1)
     sectors = [] # type: List[Sector]
     for aims_sector in aims_duty:
-        sectors.append(process_aims_sector(aims_sector, date))
+        sectors.append(process_aims_sector(aims_sector, date, crew_pages,
+                                           crew_cache))
     return Duty(duty_start, duty_end, trip_id, sectors)
 
 
-def process_aims_sector(aims_sector: AimsSector, date: dt.date
+def process_aims_sector(
+        aims_sector: AimsSector, date: dt.date,
+        crew_pages: Optional[Dict[str, Union[str, List[Crewmember]]]] = None,
+        crew_cache: Optional[MutableMapping[str, List[Crewmember]]] = None
 ) -> Sector:
     """Convert an AimsSector object into a Sector object.
 
     Args:
         aims_sector: An AimsSector object, as described in the
             documentation for parse.parse_trip_details().
+        crew_pages: A dictionary mapping sector identifiers to either
+            crew list HTML, as returned by fetch_crewlists(), or
+            already parsed crew lists.
+        crew_cache: A dictionary-like object mapping sector identifiers
+            to the crew lists of flown sectors. It is consulted if a
+            crew list is not in crew_pages, and crew lists are added
+            to it as they are found. Crew lists that are in neither
+            are downloaded on demand.
 
     Returns:
         A Sector object.
@@ -215,46 +711,113 @@ def process_aims_sector(aims_sector: AimsSector, date: dt.date
         id_, flightnum, from_, to, sched_off, sched_on = aims_sector[:6]
     except:
         raise BadAIMSSector(str(aims_sector))
-    off, on, reg = (None,) * 3
-    pax = False
-    for field in aims_sector[6:]:
-        if re.match(r"A\d{4}", field):
-            if not off:
-                off = field[1:]
-            else:
-                on = field[1:]
-        elif re.match(r"\w{1,2}-\w{3,5}", field):
-            reg = field
-        elif field == "PAX":
-            pax = True
+    off, on, reg, pax = _classify_fields(aims_sector[6:])
     try:
-        sched_off, sched_on = (X + "+0" if len(X) == 4 else X
-                               for X in (sched_off, sched_on))
-        sched_off_t, sched_on_t = (dt.datetime.strptime(X[:4], "%H%M").time()
-                                   for X in (sched_off, sched_on))
-        sched_off_dt = (dt.datetime.combine(date, sched_off_t)
-                        + dt.timedelta(days=int(sched_off[5])))
-        sched_on_dt = (dt.datetime.combine(date, sched_on_t)
-                       + dt.timedelta(days=int(sched_on[5])))
+        sched_off_dt, sched_on_dt = (_sched_datetime(date, X)
+                                     for X in (sched_off, sched_on))
         #actual times don't have +1 for after midnight, so use proximity to schedule
         off_dt, on_dt = None, None
         if on:
-            off_t, on_t = (dt.datetime.strptime(X[:4], "%H%M").time()
-                           for X in (off, on))
-            off_dt, on_dt = (dt.datetime.combine(date, X)
-                             for X in (off_t, on_t))
-            if sched_off_dt - off_dt > dt.timedelta(days=1) / 2:
-                off_dt += dt.timedelta(days=1)
-            if sched_on_dt - on_dt > dt.timedelta(days=1) / 2:
-                on_dt += dt.timedelta(days=1)
+            off_dt, on_dt = (dt.datetime.combine(date, _hhmm(X[:4]))
+                             for X in (off, on))
+            if sched_off_dt - off_dt > _HALF_DAY:
+                off_dt += _ONE_DAY
+            if sched_on_dt - on_dt > _HALF_DAY:
+                on_dt += _ONE_DAY
     except:
         raise BadAIMSSector(str(date) + ", " + str(aims_sector))
     #only get crewlist if we have actual times and were not positioning
     crewlist: List[Crewmember] = []
     if on and not pax:
-        html = access.get_crewlist(id_)
-        crewlist = parse.parse_crewlist(html)
+        crew = crew_pages.get(id_) if crew_pages else None
+        if crew is None and crew_cache is not None:
+            crew = crew_cache.get(id_)
+        if crew is None:
+            crew = access.get_crewlist(id_)
+        crewlist = (crew if isinstance(crew, list)
+                    else parse.parse_crewlist(crew))
+        if crew_cache is not None:
+            crew_cache[id_] = crewlist
     if not id_: #quasi sector
         flightnum = "[{}]".format(flightnum)
     return Sector(flightnum, from_, to, sched_off_dt, sched_on_dt,
                   off_dt, on_dt, reg, pax, crewlist)
+
+
+def _classify_fields(fields: List[str]
+) -> Tuple[Optional[str], Optional[str], Optional[str], bool]:
+    """Extract the fields of interest from the tail of an AimsSector.
+
+    Args:
+        fields: The fields of an AimsSector after the first six.
+
+    Returns:
+        A tuple (off, on, reg, pax). off and on are the actual times
+        in HHMM format, reg is the tail number and pax is True if the
+        sector is a positioning sector. Fields that are not present are
+        None.
+    """
+    off, on, reg = (None,) * 3
+    pax = False
+    for field in fields:
+        match = _FIELD_RE.match(field)
+        if match is None:
+            if field == "PAX":
+                pax = True
+        elif match.lastindex:
+            if not off:
+                off = field[1:]
+            else:
+                on = field[1:]
+        else:
+            reg = field
+    return off, on, reg, pax
+
+
+def _sched_datetime(date: dt.date, sched: str) -> dt.datetime:
+    """Convert a scheduled time, e.g. "0630" or "0130+1", to a datetime.
+
+    Raises:
+        ValueError, IndexError: sched is malformed.
+    """
+    days = 0 if len(sched) == 4 else int(sched[5])
+    result = dt.datetime.combine(date, _hhmm(sched[:4]))
+    return result + dt.timedelta(days=days) if days else result
+
+
+def _hhmm(str_: str) -> dt.time:
+    """Convert "HHMM" to a time, as strptime with "%H%M" would.
+
+    The handful of distinct times in a roster are cached, since this
+    is called several times for every sector. Anything other than four
+    ASCII digits is left to strptime.
+
+    Raises:
+        ValueError: str_ is not a valid time.
+    """
+    time = _hhmm_times.get(str_)
+    if time is None:
+        if len(str_) == 4 and not str_.strip(_DIGITS):
+            time = dt.time(int(str_[:2]), int(str_[2:]))
+        else:
+            time = dt.datetime.strptime(str_, "%H%M").time()
+        _hhmm_times[str_] = time
+    return time
+
+
+def _h_mm(str_: str) -> dt.time:
+    """Convert "H:MM" or "HH:MM" to a time, as strptime with "%H:%M" would.
+
+    Raises:
+        ValueError: str_ is not a valid time.
+    """
+    time = _h_mm_times.get(str_)
+    if time is None:
+        hours, sep, minutes = str_.partition(":")
+        if (sep and 0 < len(hours) < 3 and 0 < len(minutes) < 3
+                and not (hours + minutes).strip(_DIGITS)):
+            time = dt.time(int(hours), int(minutes))
+        else:
+            time = dt.datetime.strptime(str_, "%H:%M").time()
+        _h_mm_times[str_] = time
+    return time
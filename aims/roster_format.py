@@ -1,13 +1,20 @@
-from typing import List
+from typing import Iterable, Iterator, List
 from  aims.mytypes import *
 import datetime as dt
 import re
 from dateutil import tz
 
 def dump(dutylist: List[Duty]) -> str:
-    dutylist.sort()
-    output = []
-    for duty in dutylist:
+    return "\n".join(iter_dump(sorted(dutylist)))
+
+
+def iter_dump(duties: Iterable[Duty]) -> Iterator[str]:
+    """Yield the lines of a roster one by one.
+
+    Unlike dump(), duties are not sorted, so they should be supplied in
+    date order, as produced by process.iter_duties() with sort=True.
+    """
+    for duty in duties:
         start, end = [X.replace(tzinfo=tz.tzutc()).astimezone(tz.tzlocal())
                       for X in (duty.on, duty.off)]
         duration = int((end - start).total_seconds()) // 60
@@ -25,11 +32,10 @@ def dump(dutylist: List[Duty]) -> str:
                         off, on = sector.off, sector.on
                     block += int((on - off).total_seconds()) // 60
                 airports.append(sector.to)
-            output.append("{:%d/%m/%Y %H:%M}-{:%H:%M} {} {:d}:{:02d}/{:d}:{:02d}".format(
+            yield "{:%d/%m/%Y %H:%M}-{:%H:%M} {} {:d}:{:02d}/{:d}:{:02d}".format(
                     start, end, "-".join(airports),
                     block // 60, block % 60,
-                    duration // 60, duration % 60))
+                    duration // 60, duration % 60)
         else:
-            output.append("{:%d/%m/%Y %H:%M}-{:%H:%M} {} 0:00/{:d}:{:02d}".format(
-                start, end, duty.text, duration // 60, duration % 60))
-    return "\n".join(output)
+            yield "{:%d/%m/%Y %H:%M}-{:%H:%M} {} 0:00/{:d}:{:02d}".format(
+                start, end, duty.text, duration // 60, duration % 60)
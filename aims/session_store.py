@@ -0,0 +1,98 @@
+"""Encrypted on-disk storage of authenticated AIMS sessions.
+
+Logging on to AIMS takes around 14 requests. When the program is run
+repeatedly (e.g. checking for changes from cron), the session cookies
+and AIMS base URL from the previous run can be stored and reused
+until AIMS expires the session.
+
+The stored session is encrypted with a key that is kept in a separate
+file readable only by the current user. The password is never stored.
+
+This module requires the cryptography package.
+"""
+
+import datetime as dt
+import os
+import pickle
+from typing import Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken # type: ignore
+except ImportError:
+    Fernet = None
+
+SESSION_DIRECTORY = os.path.expanduser("~/.cache")
+KEY_FILE = os.path.expanduser("~/.config/aims/session.key")
+
+#Sessions older than this are not worth probing
+MAX_AGE = dt.timedelta(hours=12)
+
+
+def available() -> bool:
+    """Return True if session storage is supported."""
+    return Fernet is not None
+
+
+def _session_file(username: str) -> str:
+    return os.path.join(SESSION_DIRECTORY, "aims.session." + username)
+
+
+def _write_private(filename: str, data: bytes) -> None:
+    """Atomically write data to a file only readable by the current user."""
+    tmp = filename + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, filename)
+
+
+def _fernet() -> "Fernet":
+    try:
+        with open(KEY_FILE, "rb") as f:
+            return Fernet(f.read())
+    except FileNotFoundError:
+        key = Fernet.generate_key()
+        os.makedirs(os.path.dirname(KEY_FILE), mode=0o700, exist_ok=True)
+        _write_private(KEY_FILE, key)
+        return Fernet(key)
+
+
+def load(username: str) -> Optional[dict]:
+    """Load a stored session.
+
+    Args:
+        username: The AIMS username that the session belongs to.
+
+    Returns:
+        The dictionary that was passed to save(), or None if there is
+        no usable stored session.
+    """
+    if not available(): return None
+    try:
+        with open(_session_file(username), "rb") as f:
+            data = _fernet().decrypt(f.read(), int(MAX_AGE.total_seconds()))
+        return pickle.loads(data)
+    except (OSError, InvalidToken, pickle.UnpicklingError):
+        return None
+
+
+def save(username: str, state: dict) -> None:
+    """Store a session.
+
+    Args:
+        username: The AIMS username that the session belongs to.
+        state: A picklable dictionary, as returned by
+            access.session_state().
+    """
+    if not available(): return
+    os.makedirs(SESSION_DIRECTORY, exist_ok=True)
+    _write_private(_session_file(username),
+                   _fernet().encrypt(pickle.dumps(state)))
+
+
+def delete(username: str) -> None:
+    """Remove a stored session, if there is one."""
+    try:
+        os.remove(_session_file(username))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,109 @@
+"""Named spans for finding out where the time goes in a run.
+
+The stages of a run (connecting, fetching rosters, parsing, resolving
+trips, downloading crew lists, cache access and rendering output) are
+wrapped in spans:
+
+    with spans.span("parse roster"):
+        ...
+
+Nothing is recorded unless enable() has been called, and span() then
+costs no more than a function call returning a shared do-nothing
+context manager. Recorded spans can be written out in the Chrome
+trace event format, which can be loaded into chrome://tracing,
+Perfetto or speedscope.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import ContextManager, List, Optional
+
+_events = None # type: Optional[List[dict]]
+_threads = set() # type: set
+_origin = 0.0
+_lock = threading.Lock()
+
+
+class _Span:
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        end = time.perf_counter()
+        tid = threading.get_ident()
+        pid = os.getpid()
+        with _lock:
+            if _events is None: return
+            if tid not in _threads:
+                _threads.add(tid)
+                _events.append({
+                    "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                    "args": {"name": threading.current_thread().name}})
+            _events.append({
+                "name": self.name, "ph": "X", "pid": pid, "tid": tid,
+                "ts": (self.start - _origin) * 1e6,
+                "dur": (end - self.start) * 1e6})
+
+
+class _NullSpan:
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+def span(name: str) -> ContextManager:
+    """Return a context manager that records the time spent within it.
+
+    Args:
+        name: The name of the span, e.g. "fetch crew lists".
+    """
+    if _events is None: return _NULL
+    return _Span(name)
+
+
+def enable() -> None:
+    """Start recording spans, discarding any recorded earlier."""
+    global _events, _origin
+    with _lock:
+        _events = []
+        _threads.clear()
+        _origin = time.perf_counter()
+
+
+def disable() -> List[dict]:
+    """Stop recording spans.
+
+    Returns:
+        The recorded spans as Chrome trace events.
+    """
+    global _events
+    with _lock:
+        events, _events = _events or [], None
+    return events
+
+
+def enabled() -> bool:
+    return _events is not None
+
+
+def write_trace(path: str, events: List[dict]) -> None:
+    """Write trace events to a file in the Chrome trace event format."""
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
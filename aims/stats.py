@@ -0,0 +1,132 @@
+"""Counters and timings collected during a run.
+
+Every response from AIMS is recorded against its endpoint (e.g.
+"GET schedule" for trip sheets, "POST schedule" for brief rosters):
+the number of requests, how many failed, a histogram of how long they
+took and the bytes received. Named counters record things such as
+trip cache hits and misses. The figures accumulate until reset() is
+called, and are safe to update from several threads at once.
+"""
+
+import json
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+#Upper bounds, in seconds, of the latency histogram buckets. The last
+#bucket catches everything slower.
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_endpoints = {} # type: Dict[str, dict]
+_counters = Counter() # type: Counter
+
+
+def _new_endpoint() -> dict:
+    return {"requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+            "histogram": [0] * (len(BUCKETS) + 1),
+            "wire_bytes": 0, "bytes": 0}
+
+
+def record_request(endpoint: str, seconds: float, wire_bytes: int = 0,
+                   bytes_: int = 0, ok: bool = True) -> None:
+    """Record a request.
+
+    Args:
+        endpoint: The name of the endpoint, e.g. "GET getlegmem".
+        seconds: How long the request took, including any retries.
+        wire_bytes: The number of body bytes received.
+        bytes_: The number of body bytes after decompression.
+        ok: False if the request failed.
+    """
+    bucket = next((i for i, X in enumerate(BUCKETS) if seconds <= X),
+                  len(BUCKETS))
+    with _lock:
+        stats = _endpoints.setdefault(endpoint, _new_endpoint())
+        stats["requests"] += 1
+        stats["errors"] += not ok
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["histogram"][bucket] += 1
+        stats["wire_bytes"] += wire_bytes
+        stats["bytes"] += bytes_
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add n to the counter called name."""
+    if not n: return
+    with _lock:
+        _counters[name] += n
+
+
+def reset() -> None:
+    with _lock:
+        _endpoints.clear()
+        _counters.clear()
+
+
+def snapshot() -> dict:
+    """Return the figures collected so far.
+
+    Returns:
+        A dictionary with an "endpoints" key, mapping endpoint names to
+        dictionaries of figures for that endpoint, a "counters" key,
+        mapping counter names to values, and a "buckets" key, listing
+        the upper bounds of the histogram buckets.
+    """
+    with _lock:
+        return {
+            "endpoints": {K: dict(V, histogram=list(V["histogram"]))
+                          for K, V in _endpoints.items()},
+            "counters": dict(_counters),
+            "buckets": list(BUCKETS),
+        }
+
+
+def dumps(snapshot_: Optional[dict] = None) -> str:
+    """Return a snapshot as JSON."""
+    return json.dumps(snapshot_ or snapshot(), sort_keys=True, indent=4)
+
+
+def percentile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Estimate a percentile of the latencies in a histogram.
+
+    Returns:
+        The upper bound of the bucket containing the percentile, or
+        None if it falls in the last, unbounded, bucket.
+    """
+    target = fraction * sum(histogram)
+    total = 0
+    for bound, n in zip(BUCKETS, histogram):
+        total += n
+        if n and total >= target:
+            return bound
+    return None
+
+
+def table(snapshot_: Optional[dict] = None) -> str:
+    """Return a snapshot as a table for people to read.
+
+    Endpoints are listed slowest first. The p90 column is an upper
+    bound on the time taken by 90% of requests.
+    """
+    snapshot_ = snapshot_ or snapshot()
+    lines = ["{:<16} {:>5} {:>5} {:>8} {:>7} {:>6} {:>7} {:>9} {:>9}".format(
+        "Endpoint", "Reqs", "Errs", "Total s", "Mean s", "p90 s", "Max s",
+        "Wire KB", "KB")]
+    endpoints = snapshot_["endpoints"]
+    for name in sorted(endpoints, key=lambda X: -endpoints[X]["seconds"]):
+        X = endpoints[name]
+        p90 = percentile(X["histogram"], 0.9)
+        lines.append(
+            "{:<16} {:>5} {:>5} {:>8.2f} {:>7.3f} {:>6} {:>7.3f} {:>9.1f} "
+            "{:>9.1f}".format(
+                name, X["requests"], X["errors"], X["seconds"],
+                X["seconds"] / X["requests"],
+                ">" + str(BUCKETS[-1]) if p90 is None else str(p90),
+                X["max_seconds"], X["wire_bytes"] / 1024, X["bytes"] / 1024))
+    if snapshot_["counters"]:
+        lines.append("")
+    for name, value in sorted(snapshot_["counters"].items()):
+        lines.append("{:<24} {:>8}".format(name, value))
+    return "\n".join(lines)
@@ -0,0 +1,188 @@
+"""Long running mode that keeps roster files up to date.
+
+The watcher logs on once, then polls the AIMS index page. Polling
+also keeps the session alive. When the index page shows that there are
+no changes waiting to be acknowledged, and either this is the first
+poll or changes have just been acknowledged, the rosters are
+downloaded again and the output files are rewritten.
+
+Only trips on days whose brief roster entries have changed since the
+last refresh are downloaded again; all other trips come from the trip
+cache as usual.
+"""
+
+import datetime as dt
+import random
+import time
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+import requests
+
+from aims.mytypes import *
+from aims import access, cache, output, parse, process
+
+INTERVAL = 15 * 60
+JITTER = 0.2
+MAX_BACKOFF = 4 * 60 * 60
+
+TripKey = Tuple[dt.date, str]
+
+
+def next_delay(interval: float, jitter: float, failures: int,
+               max_backoff: float, rnd: random.Random = random) -> float:
+    """Work out how long to wait before the next poll.
+
+    Args:
+        interval: The normal time between polls in seconds.
+        jitter: The fraction by which the delay is randomly varied,
+            so that many watchers started by cron at the same time do
+            not poll AIMS together.
+        failures: The number of polls in a row that have failed. The
+            interval is doubled for each of them...
+        max_backoff: ...up to this many seconds.
+        rnd: The random number generator to use.
+    """
+    delay = interval
+    if failures:
+        delay = min(interval * 2 ** failures, max(max_backoff, interval))
+    return delay * (1 + rnd.uniform(-jitter, jitter))
+
+
+def changed_trips(old: List[RosterEntry], new: List[RosterEntry]
+) -> Set[TripKey]:
+    """Find the trips affected by changes to a roster.
+
+    Args:
+        old: The roster entries before the change.
+        new: The roster entries after the change.
+
+    Returns:
+        A set of (date, trip_id) keys, as used by the trip cache, of
+        the trips in new that are on a day whose entry has changed.
+        If a changed day continues a trip from an earlier day, that
+        trip is included too.
+    """
+    old_items = {X.aims_day: X.items for X in old}
+    changed = set()
+    running = None # type: Optional[TripKey]
+    for entry in new:
+        date = process._aims_date(entry.aims_day)
+        trips = [(date, X) for X in process._entry_items(entry, date)
+                 if isinstance(X, str)]
+        previous = old_items.get(entry.aims_day)
+        if previous != entry.items:
+            changed.update(trips)
+            if running and ("==>" in entry.items
+                            or (previous and "==>" in previous)):
+                changed.add(running)
+        if trips:
+            running = trips[0]
+    return changed
+
+
+class Watcher:
+    """Polls AIMS and rewrites output files when the roster changes.
+
+    Args:
+        connect: A function that logs on to AIMS.
+        outputs: A list of (format, path) tuples, as accepted by
+            output.render().
+        offsets: The offsets of the rosters to extract, as accepted by
+            access.get_brief_roster().
+        workers: The maximum number of pages to download
+            simultaneously.
+        last_ics: Passed on to output.render().
+        policy: The RetentionPolicy the trip cache is pruned with.
+    """
+
+    def __init__(self, connect: Callable[[], None],
+                 outputs: List[Tuple[str, Optional[str]]],
+                 offsets: Sequence[int] = (0,),
+                 workers: int = process.FETCH_WORKERS,
+                 last_ics: Optional[str] = None,
+                 policy: cache.RetentionPolicy = cache.DEFAULT_POLICY
+) -> None:
+        self.connect = connect
+        self.outputs = outputs
+        self.offsets = offsets
+        self.workers = workers
+        self.last_ics = last_ics
+        self.policy = policy
+        self.connected = False
+        self.changes = None # type: Optional[bool]
+        self.entries = None # type: Optional[List[RosterEntry]]
+
+    def poll(self) -> None:
+        """Check the index page once, refreshing the outputs if required.
+
+        Raises:
+            requests.RequestException, AIMSException: The poll failed.
+        """
+        if not self.connected:
+            self.connect()
+            self.connected = True
+        index_page = access.get_index_page()
+        if index_page.find(access.INDEX_MARKER) == -1:
+            #the session has expired
+            self.connect()
+            index_page = access.get_index_page()
+        changes = index_page.find(access.NO_CHANGES_MARKER) == -1
+        if changes and self.changes is not True:
+            access.fprint("You have changes.\n")
+        elif not changes and self.changes is not False:
+            self.refresh()
+        self.changes = changes
+
+    def refresh(self) -> None:
+        """Download the rosters again and rewrite the outputs."""
+        access.forget_rosters()
+        periods = [parse.parse_brief_roster(access.get_brief_roster(X))
+                   for X in self.offsets]
+        entries = [X for period in periods for X in period]
+        if self.entries is not None:
+            stale = changed_trips(self.entries, entries)
+            if stale:
+                trip_cache = cache.get_cache()
+                for key in stale:
+                    trip_cache["trips"].pop(key, None)
+                cache.save_cache(trip_cache)
+        dutylist = process.process_roster_periods(periods, False,
+                                                  self.workers, self.policy)
+        output.render(dutylist, self.outputs, self.last_ics)
+        self.entries = entries
+
+    def run(self, interval: float = INTERVAL, jitter: float = JITTER,
+            max_backoff: float = MAX_BACKOFF,
+            polls: Optional[int] = None,
+            sleep: Callable[[float], None] = time.sleep) -> None:
+        """Poll until interrupted.
+
+        Args:
+            interval, jitter, max_backoff: See next_delay().
+            polls: Stop after this many polls. Mostly useful for
+                testing.
+            sleep: The function used to wait between polls.
+
+        Failed polls are reported and retried with exponential
+        backoff. An expired session is replaced by logging on again.
+        CaptchaOn and LogonError are raised, since retrying will not
+        help.
+        """
+        failures = 0
+        count = 0
+        while polls is None or count < polls:
+            count += 1
+            try:
+                self.poll()
+                failures = 0
+            except (CaptchaOn, LogonError):
+                #trying again will not help
+                raise
+            except requests.RequestException as e:
+                failures += 1
+                access.fprint("\n{} {}\n".format(e.__doc__, e))
+            except AIMSException as e:
+                failures += 1
+                access.fprint("\n{} {}\n".format(e.__doc__, e.str_))
+            if polls is None or count < polls:
+                sleep(next_delay(interval, jitter, failures, max_backoff))
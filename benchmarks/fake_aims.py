@@ -0,0 +1,325 @@
+"""A local stand-in for the Crew Portal and AIMS servers.
+
+The fake server implements just enough of the real servers for
+aims.access to work against it: the sign on procedure (including the
+SAML hop and the "Please log out and try again" behaviour introduced
+by the 2019-03-14 AIMS update), the index page, brief rosters with
+previous/next period navigation, trip sheets and crew lists. The pages
+are generated by benchmarks.synthetic.
+
+Latency and errors can be injected to test concurrency and retry
+behaviour. To run it standalone:
+
+    python -m benchmarks.fake_aims --port 8080 --latency 0.1
+    aims roster 001234 --base_url http://localhost:8080
+
+The password is "password".
+"""
+
+import argparse
+import gzip
+import random
+import secrets
+import socketserver
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional, Tuple
+
+from benchmarks import synthetic
+
+PERIOD_DAYS = 28
+NO_CHANGES = '\r\nvar notification = Trim("");\r\n'
+CHANGES = '\r\nvar notification = Trim("You have changes");\r\n'
+
+
+class FakeAims:
+    """A fake AIMS server.
+
+    Args:
+        months: The number of roster periods available.
+        current: The index of the current roster period.
+        latency: Seconds added to every response.
+        jitter: Up to this many further seconds are randomly added to
+            every response.
+        error_rate: The probability that a request for an AIMS page
+            (as opposed to a sign on page) fails with a 503 error.
+        changes: If True, the index page shows "red writing".
+        logout_quirk: If True, the first AIMS auto logon of each
+            session asks the user to log out and try again.
+        jumps: If True, the brief roster form's DISPLAY_DAY field
+            jumps to the roster containing that day. Otherwise it is
+            ignored and the current roster is shown.
+        password: The password that will be accepted.
+        seed: Seed for the synthetic roster generator.
+        first_day: The aims_day of the first day of the first roster
+            period.
+        gzip: If True, responses are gzip compressed for clients that
+            accept it.
+
+    Attributes:
+        requests: A Counter of requests made, keyed on method and path,
+            e.g. "GET /aims/perinfo.exe/index".
+        connections: The number of TCP connections accepted.
+    """
+
+    def __init__(self, months: int = 13, current: int = 6,
+                 latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, changes: bool = False,
+                 logout_quirk: bool = True, jumps: bool = True,
+                 password: str = "password",
+                 seed: int = 0,
+                 first_day: int = synthetic.FIRST_DAY,
+                 gzip: bool = False) -> None:
+        self.roster = synthetic.roster(months, seed, first_day)
+        self.first_day = first_day
+        self.months = months
+        self.current = current
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.changes = changes
+        self.logout_quirk = logout_quirk
+        self.jumps = jumps
+        self.password = password
+        self.gzip = gzip
+        self.requests = Counter() # type: Counter
+        self.connections = 0
+        self.sessions = {} # type: Dict[str, dict]
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None # type: Optional[HTTPServer]
+
+    def period_days(self, period: int) -> Tuple[int, int]:
+        """Return the first and last aims_day of a roster period."""
+        first = self.first_day + PERIOD_DAYS * period
+        return first, first + PERIOD_DAYS - 1
+
+    def brief_roster(self, period: int) -> str:
+        first, last = self.period_days(period)
+        return synthetic.brief_roster(
+            [X for X in self.roster.days if first <= X[0] <= last])
+
+    def start(self, port: int = 0) -> str:
+        """Start serving in a background thread.
+
+        Args:
+            port: The port to listen on. 0 picks a free port.
+
+        Returns:
+            The base URL of the server, for passing to access.connect().
+        """
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return "http://localhost:{}".format(self._server.server_address[1])
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeAims":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _delay(self) -> None:
+        with self.lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay: time.sleep(delay)
+
+    def _fail(self) -> bool:
+        with self.lock:
+            return self._random.random() < self.error_rate
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    fake = None # type: FakeAims
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.fake.lock:
+            self.fake.connections += 1
+
+    @property
+    def fake(self) -> FakeAims:
+        return self.server.fake
+
+    def _base(self) -> str:
+        return "http://" + self.headers["Host"]
+
+    def _send(self, body: str, status: int = 200,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        data = body.encode("utf-8")
+        headers = dict(headers or {})
+        if (self.fake.gzip
+            and "gzip" in self.headers.get("Accept-Encoding", "")):
+            data = gzip.compress(data)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, path: str) -> None:
+        self._send("", 302, {"Location": self._base() + path})
+
+    def _session(self) -> Optional[dict]:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if "fakeaims" not in cookie: return None
+        return self.fake.sessions.get(cookie["fakeaims"].value)
+
+    def _form(self) -> Dict[str, str]:
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length).decode("utf-8")
+        return dict(urllib.parse.parse_qsl(data, keep_blank_values=True))
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path
+        query = dict(urllib.parse.parse_qsl(url.query))
+        form = self._form() if method == "POST" else {}
+        fake = self.fake
+        with fake.lock:
+            fake.requests[method + " " + path] += 1
+        fake._delay()
+        session = self._session()
+        if path == "/" and method == "GET":
+            token = secrets.token_hex(8)
+            with fake.lock:
+                fake.sessions[token] = {"logged_in": False, "period": 0,
+                                        "logged_out": False}
+            self._send("<html><body><form action='/my.policy'>"
+                       "</form></body></html>",
+                       headers={"Set-Cookie": "fakeaims=" + token})
+        elif path == "/my.policy":
+            if session is None or form.get("password") != fake.password:
+                self._send("<html><body><form><input name='x'>"
+                           "</form></body></html>")
+            else:
+                self._send("<html><body><form action='{}/saml/idp'>"
+                           "<input name='SAMLRequest' value='req'>"
+                           "</form></body></html>".format(self._base()))
+        elif path == "/saml/idp":
+            self._send("<html><body><form action='{}/saml/sp'>"
+                       "<input name='SAMLResponse' value='resp'>"
+                       "</form></body></html>".format(self._base()))
+        elif path == "/saml/sp":
+            self._redirect("/portal/")
+        elif path == "/portal/":
+            self._send("<html><body>Crew Portal</body></html>")
+        elif path == "/portal/cms/f5-h-$$/portal/cms/redirect/ecrew":
+            self._redirect("/aims/wtouch.exe/verify")
+        elif path == "/aims/wtouch.exe/verify":
+            if session is None:
+                self._redirect("/")
+            elif fake.logout_quirk and not session["logged_out"]:
+                self._send("<html><body>Please log out and try again."
+                           "</body></html>")
+            else:
+                session["logged_in"] = True
+                self._send("<html><body>Please wait</body></html>")
+        elif path == "/aims/perinfo.exe/AjAction":
+            if session is not None:
+                session["logged_out"] = True
+            self._send("")
+        elif path.startswith("/aims/perinfo.exe/"):
+            if session is None or not session["logged_in"]:
+                self._redirect("/")
+            elif fake._fail():
+                self._send("Service Unavailable", 503)
+            else:
+                self._aims_page(path[len("/aims/perinfo.exe/"):],
+                                method, query, form, session)
+        else:
+            self._send("Not Found", 404)
+
+    def _aims_page(self, page: str, method: str, query: Dict[str, str],
+                   form: Dict[str, str], session: dict) -> None:
+        fake = self.fake
+        if page == "index":
+            self._send("<html><head><script>{}</script></head>"
+                       "<body>AIMS</body></html>".format(
+                           CHANGES if fake.changes else NO_CHANGES))
+        elif page == "schedule" and method == "POST":
+            day = int(form.get("DISPLAY_DAY", "0"))
+            if fake.jumps and day:
+                session["period"] = (
+                    (day - fake.first_day) // PERIOD_DAYS - fake.current)
+            elif form.get("Direc") == "2":
+                session["period"] += 1
+            elif form.get("Direc") == "1":
+                session["period"] -= 1
+            else:
+                session["period"] = 0
+            period = fake.current + session["period"]
+            if not 0 <= period < fake.months:
+                self._send("<html><body>No roster</body></html>")
+            else:
+                self._send(fake.brief_roster(period))
+        elif page == "schedule":
+            html = fake.roster.trips.get(
+                (query.get("ORGDAY"), query.get("CROUTE")),
+                "<html><body>Unable to find the trip details</body></html>")
+            self._send(html)
+        elif page == "getlegmem":
+            html = fake.roster.crewlists.get(query.get("LegInfo"))
+            if html is None:
+                self._send("Not Found", 404)
+            else:
+                self._send(html)
+        else:
+            self._send("Not Found", 404)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.fake_aims",
+        description="Run a local stand-in for the AIMS servers.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--months", type=int, default=13)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--changes", action="store_true")
+    parser.add_argument("--no_jumps", action="store_true")
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+    fake = FakeAims(args.months, args.months // 2, args.latency,
+                    args.jitter, args.error_rate, args.changes,
+                    jumps=not args.no_jumps, gzip=args.gzip)
+    print("Serving on {}".format(fake.start(args.port)))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Benchmarks for the parse -> process -> format pipeline.
+
+Usage:
+
+    python -m benchmarks run [--scales 1,10,100] [--repeat N] [--output FILE]
+    python -m benchmarks compare OLD.json NEW.json
+    python -m benchmarks commits OLD_REV NEW_REV [--scales ...] [--repeat N]
+
+"run" times each stage of the pipeline against synthetic rosters of 1,
+10 and 100 months and records the best time and the peak memory
+allocated. "compare" shows the ratio between two sets of saved
+results. "commits" checks out two revisions into temporary git
+worktrees, runs the benchmarks against each and compares them. No
+network access is required: the AIMS access functions are replaced by
+lookups of synthetic pages.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks import synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(func: Callable[..., Any],
+            setup: Callable[[], Tuple] = lambda: (),
+            repeat: int = 5) -> Dict[str, float]:
+    """Time a function and measure its peak memory allocation.
+
+    Args:
+        func: The function to measure.
+        setup: A function returning the arguments for func. It is
+            called before every call of func and is not timed.
+        repeat: The number of timed calls.
+
+    Returns:
+        A dictionary with the best and mean times in seconds ("best"
+        and "mean") and the peak bytes allocated during one further
+        call ("peak_bytes").
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"best": min(times), "mean": sum(times) / len(times),
+            "peak_bytes": peak}
+
+
+def run_scale(months: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Benchmark every stage against a roster of the given length."""
+    #aims is imported here rather than at the top of the module so that
+    #HOME (and hence the cache location) can be set first, and so that
+    #the "commits" command can choose which copy of aims is imported.
+    from aims import access, parse, process
+    from aims import roster_format, logbook_format, ical_format
+    from aims.mytypes import RosterEntry
+    roster = synthetic.roster(months)
+    access.fprint = lambda x: None
+    access.get_trip = lambda aims_day, trip: roster.trips[(aims_day, trip)]
+    access.get_crewlist = lambda id_: roster.crewlists[id_]
+    entries = parse.parse_brief_roster(roster.brief_roster)
+    #older revisions consume the items of the entries they process
+    copy_entries = lambda: ([RosterEntry(X.aims_day, list(X.items))
+                             for X in entries],)
+    dutylist = process.process_roster_entries(copy_entries()[0], True)
+    trips = list(roster.trips.values())
+    crewlists = list(roster.crewlists.values())
+    results = {}
+    #the parsed brief roster is memoised, so parse a new string each time
+    serial = itertools.count()
+    results["parse_brief_roster"] = measure(
+        parse.parse_brief_roster,
+        lambda: (roster.brief_roster + "<!--{}-->".format(next(serial)),),
+        repeat)
+    results["parse_trip_details"] = measure(
+        lambda: [parse.parse_trip_details(X) for X in trips], repeat=repeat)
+    results["parse_crewlist"] = measure(
+        lambda: [parse.parse_crewlist(X) for X in crewlists], repeat=repeat)
+    results["process_roster_entries"] = measure(
+        lambda entries: process.process_roster_entries(entries, True),
+        copy_entries, repeat)
+    #sector decoding on its own: the crew lists are parsed beforehand
+    sectors = [X for html in trips for duty in parse.parse_trip_details(html)
+               for X in duty]
+    parsed_crewlists = {X: parse.parse_crewlist(X) for X in crewlists}
+    parse_crewlist = parse.parse_crewlist
+    parse.parse_crewlist = parsed_crewlists.__getitem__
+    try:
+        results["process_aims_sector"] = measure(
+            lambda: [process.process_aims_sector(X, datetime.date(2018, 1, 1))
+                     for X in sectors], repeat=repeat)
+    finally:
+        parse.parse_crewlist = parse_crewlist
+    results["roster_format"] = measure(
+        roster_format.dump, lambda: (list(dutylist),), repeat)
+    results["logbook_format"] = measure(
+        logbook_format.dump, lambda: (list(dutylist),), repeat)
+    results["ical_format"] = measure(
+        ical_format.dump, lambda: (list(dutylist),), repeat)
+    results["json"] = measure(
+        lambda: json.dumps(dutylist, sort_keys=True, indent=4,
+                           default=lambda x: x.__str__()),
+        repeat=repeat)
+    return results
+
+
+def _git_commit(path: str) -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=path, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(scales: List[int], repeat: int) -> dict:
+    """Run the benchmarks at each scale, using a temporary cache."""
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["HOME"] = home
+        import aims
+        results = {
+            "commit": _git_commit(os.path.dirname(
+                os.path.dirname(os.path.abspath(aims.__file__)))),
+            "python": platform.python_version(),
+            "results": {},
+        }
+        for months in scales:
+            sys.stderr.write("Running {}x ".format(months))
+            sys.stderr.flush()
+            results["results"]["{}x".format(months)] = run_scale(
+                months, repeat)
+            sys.stderr.write("Done\n")
+    return results
+
+
+def print_results(results: dict) -> None:
+    print("commit {}".format(results["commit"]))
+    print("{:<24} {:>6} {:>12} {:>12}".format(
+        "stage", "scale", "best (ms)", "peak (KiB)"))
+    for scale, stages in results["results"].items():
+        for stage, r in stages.items():
+            print("{:<24} {:>6} {:>12.2f} {:>12.1f}".format(
+                stage, scale, r["best"] * 1000, r["peak_bytes"] / 1024))
+
+
+def compare(old: dict, new: dict) -> None:
+    """Print the ratio of new to old results for each stage and scale."""
+    print("old {}\nnew {}".format(old["commit"], new["commit"]))
+    print("{:<24} {:>6} {:>10} {:>10} {:>7} {:>7}".format(
+        "stage", "scale", "old (ms)", "new (ms)", "time", "memory"))
+    for scale, stages in new["results"].items():
+        for stage, r in stages.items():
+            o = old["results"].get(scale, {}).get(stage)
+            if not o: continue
+            print("{:<24} {:>6} {:>10.2f} {:>10.2f} {:>6.2f}x {:>6.2f}x".format(
+                stage, scale, o["best"] * 1000, r["best"] * 1000,
+                r["best"] / o["best"],
+                r["peak_bytes"] / o["peak_bytes"] if o["peak_bytes"] else 0))
+
+
+def run_commit(rev: str, scales: List[int], repeat: int) -> dict:
+    """Run these benchmarks against the aims package of another revision."""
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = os.path.join(tmp, "worktree")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, rev],
+                       cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        try:
+            code = ("import sys; sys.path.insert(0, {!r}); "
+                    "from benchmarks import run; "
+                    "sys.path.insert(0, {!r}); "
+                    "run.main(['run', '--scales', {!r}, '--repeat', '{}', "
+                    "'--output', {!r}])").format(
+                        ROOT, worktree, ",".join(str(X) for X in scales),
+                        repeat, os.path.join(tmp, "results.json"))
+            subprocess.run([sys.executable, "-c", code], cwd=tmp, check=True)
+            with open(os.path.join(tmp, "results.json")) as f:
+                return json.load(f)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree],
+                           cwd=ROOT, check=True)
+
+
+def _args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark the aims parse/process/format pipeline.")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    for name in ("run", "commits"):
+        p = sub.add_parser(name)
+        if name == "commits":
+            p.add_argument("old")
+            p.add_argument("new")
+        p.add_argument("--scales", default="1,10,100")
+        p.add_argument("--repeat", type=int, default=5)
+        p.add_argument("--output", "-o")
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _args(argv)
+    if args.command == "compare":
+        with open(args.old) as f: old = json.load(f)
+        with open(args.new) as f: new = json.load(f)
+        compare(old, new)
+        return
+    scales = [int(X) for X in args.scales.split(",")]
+    if args.command == "run":
+        results = run(scales, args.repeat)
+        print_results(results)
+    else:
+        old = run_commit(args.old, scales, args.repeat)
+        results = run_commit(args.new, scales, args.repeat)
+        compare(old, results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,184 @@
+"""Generators for synthetic AIMS pages.
+
+The pages produced here follow the structure of the real AIMS brief
+roster, trip sheet and crew list pages closely enough to exercise all
+the code paths of aims.parse and aims.process. They are deterministic
+for a given seed.
+
+A "month" is a 28 day roster period containing around a dozen trips.
+"""
+
+import random
+from typing import Dict, List, NamedTuple, Tuple
+
+AIRPORTS = ("BRS", "GLA", "NCL", "BSL", "OPO", "FNC", "LGW", "AGP",
+            "FAO", "PMI", "ACE", "TFS", "BCN", "GVA", "AMS", "CDG")
+REGS = ("G-EZTA", "G-EZWX", "G-UZHP", "OE-IVK", "OE-LQB", "HB-JXA")
+NAMES = ("SMITH JOHN", "JONES SARAH", "TAYLOR DAVID", "BROWN EMMA",
+         "WILSON JAMES", "EVANS LUCY", "THOMAS MARK", "ROBERTS ANNA")
+FIRST_DAY = 14000 #aims_day of 2018-05-01, so all duties are in the past
+
+
+class SyntheticRoster(NamedTuple):
+    """A complete set of pages for a synthetic roster.
+
+    Attributes:
+        brief_roster: The HTML of the brief roster.
+        trips: A dictionary mapping (aims_day, trip_id) to trip sheet
+            HTML.
+        crewlists: A dictionary mapping sector ids to crew list HTML.
+        days: A list of (aims_day, items) tuples, where items are the
+            strings shown for that day on the brief roster.
+    """
+    brief_roster: str
+    trips: Dict[Tuple[str, str], str]
+    crewlists: Dict[str, str]
+    days: List[Tuple[int, List[str]]]
+
+
+def _hhmm(minutes: int) -> str:
+    return "{:02d}{:02d}".format(minutes // 60 % 24, minutes % 60)
+
+
+def _h_mm(minutes: int) -> str:
+    return "{:02d}:{:02d}".format(minutes // 60 % 24, minutes % 60)
+
+
+def trip_sheet(aims_day: int, trip_num: int, days: int, rnd: random.Random
+) -> Tuple[str, List[str]]:
+    """Generate a trip sheet.
+
+    Args:
+        aims_day: The aims_day that the trip starts on.
+        trip_num: A number used to make the sector ids unique.
+        days: The number of duties in the trip.
+        rnd: The random number generator to use.
+
+    Returns:
+        A tuple of the trip sheet HTML and a list of the ids of its
+        flown sectors.
+    """
+    rows = []
+    ids = []
+    base = rnd.choice(AIRPORTS[:3])
+    for day in range(days):
+        report = rnd.randrange(5 * 60, 13 * 60, 5)
+        sectors = rnd.choice((2, 2, 4, 4, 3)) if days == 1 else 2
+        reg = rnd.choice(REGS)
+        from_ = base
+        off = report + 60
+        for sector in range(sectors):
+            to = (base if sector == sectors - 1
+                  else rnd.choice([X for X in AIRPORTS if X != from_]))
+            flight = str(rnd.randrange(1000, 9999))
+            on = off + rnd.randrange(60, 180, 5)
+            id_ = "{},{},{},{},{},1, ,{},320".format(
+                aims_day, 100000 + trip_num, aims_day + day, flight,
+                from_.lower(), to.lower())
+            ids.append(id_)
+            fields = [flight, from_, to, _hhmm(off), _hhmm(on)]
+            if on // (24 * 60): fields[-1] += "+1"
+            if sector == 0:
+                fields += ["Mon1Jan", str(day + 1)]
+            fields += ["A" + _hhmm(off + rnd.randrange(-5, 15)),
+                       "A" + _hhmm(on + rnd.randrange(-10, 10)),
+                       reg, "{}:{:02d}".format((on - off) // 60, (on - off) % 60)]
+            if sectors == 1:
+                fields += [_h_mm(report), _h_mm(on + 30)]
+            elif sector == 0:
+                fields += [_h_mm(report)]
+            elif sector == sectors - 1:
+                fields += [_h_mm(on), _h_mm(on), _h_mm(on + 30)]
+            rows.append('<tr class="mono_rows_ctrl_f3" id="{}">\n'
+                        '<td>{} </td></tr>'.format(id_, " ".join(fields)))
+            from_ = to
+            off = on + rnd.randrange(30, 60, 5)
+        if day < days - 1:
+            rows.append('<tr class="sub_table_header_blue_courier">\n'
+                        '<td> 12:00 Rest OPERATIONAL HOTEL </td></tr>')
+            base = from_
+    html = ("<html><head><title>Trip</title></head><body>"
+            "<table class='header'><tr><td>Trip Details in UTC</td></tr>"
+            "</table>\n<table>\n{}\n</table></body></html>").format(
+                "\n".join(rows))
+    return html, ids
+
+
+def crew_list(rnd: random.Random, crew: int = 6) -> str:
+    """Generate a crew list with one positioning crew member."""
+    rows = ['<tr class="sub_table_header">\n<td>ID</td><td>Name</td>'
+            '<td>Seniority</td><td>Base</td><td>AC</td><td>Pos</td>'
+            '<td>Trn Duty</td><td>Trip</td><td>PAX</td></tr>']
+    roles = ["CP", "FO", "PU"] + ["FA"] * (crew - 3) + ["FA"]
+    for c, role in enumerate(roles):
+        rows.append(
+            '<tr class="{}"><td>{}</td><td>{}</td><td></td>\n<td>BRS</td>'
+            '<td>320</td><td>{}</td><td>&nbsp;</td><td>B036</td>'
+            '<td>{}</td></tr>'.format(
+                "dual_rows" if c % 2 else "mono_rows",
+                rnd.randrange(1000, 999999), rnd.choice(NAMES), role,
+                "*" if c == len(roles) - 1 else "&nbsp;"))
+    return "<html><body><table>\n{}\n</table>\n</body></html>".format(
+        "\n</tr>".join(rows))
+
+
+def roster(months: int = 1, seed: int = 0, first_day: int = FIRST_DAY
+) -> SyntheticRoster:
+    """Generate a brief roster and all the pages it refers to.
+
+    Args:
+        months: The length of the roster in 28 day periods.
+        seed: Seed for the random number generator.
+        first_day: The aims_day of the first day of the roster.
+    """
+    rnd = random.Random(seed)
+    days = []
+    trips = {}
+    crewlists = {}
+    aims_day = first_day
+    trip_num = 0
+    while aims_day < first_day + 28 * months:
+        kind = rnd.random()
+        if kind < 0.3:
+            days.append((aims_day, ["D/O"]))
+            aims_day += 1
+        elif kind < 0.4:
+            days.append((aims_day, ["ESBY", "5:00", "13:00"]))
+            aims_day += 1
+        else:
+            length = rnd.choice((1, 1, 1, 2, 3))
+            trip_id = "B{:03d}".format(trip_num % 1000)
+            html, ids = trip_sheet(aims_day, trip_num, length, rnd)
+            trips[(str(aims_day), trip_id)] = html
+            for id_ in ids:
+                crewlists[id_] = crew_list(rnd)
+            days.append((aims_day, [trip_id]))
+            for c in range(1, length):
+                days.append((aims_day + c, ["==>"]))
+            aims_day += length
+            trip_num += 1
+    return SyntheticRoster(brief_roster(days), trips, crewlists, days)
+
+
+def brief_roster(days: List[Tuple[int, List[str]]]) -> str:
+    """Generate the HTML of a brief roster.
+
+    Args:
+        days: A list of (aims_day, items) tuples, as found in
+            SyntheticRoster.days.
+    """
+    divs = []
+    for aims_day, items in days:
+        rows = []
+        if len(items) == 3:
+            rows.append("<tr><td>{}</td><td>{}</td></tr>".format(*items[:2]))
+            rows.append("<tr><td>&nbsp;</td><td>{}</td></tr>".format(items[2]))
+        else:
+            rows.append("<tr><td>{}</td><td></td></tr>".format(
+                items[0].replace(">", "&gt;")))
+            rows.append("<tr><td>&nbsp;</td><td></td></tr>")
+        divs.append('<div id="myday_{}"><table class="duties_table">\n'
+                    '{}\n</table></div>'.format(aims_day, "\n".join(rows)))
+    return ('<html><head></head><body><div id="header">AIMS</div>'
+            '<div id="main_div">\n{}\n</div></body></html>').format(
+                "\n".join(divs))
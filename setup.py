@@ -8,6 +8,11 @@ setup(
     packages=["aims"],
     python_requires='>=3.6',
     install_requires=['Beautifulsoup4', 'requests', 'python-dateutil'],
+    extras_require={
+        'async': ['aiohttp'],
+        'session': ['cryptography'],
+        'fast': ['lxml'],
+    },
     entry_points={
         'console_scripts':
         ['aims = aims.aims:main']}
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+import asyncio
+import datetime
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import requests
+
+import aims.access as access
+import aims.cache as cache
+import aims.parse as parse
+import aims.process as process
+import aims.stats as stats
+from aims.mytypes import LogonError
+from benchmarks.fake_aims import FakeAims
+
+try:
+    import aims.access_async as access_async
+except ImportError:
+    access_async = None
+
+
+def run_coroutine(coro):
+    """asyncio.run(), with a fallback for Python 3.6."""
+    if hasattr(asyncio, "run"):
+        return asyncio.run(coro)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestAccess(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeAims(months=3, current=1)
+        cls.base_url = cls.fake.start()
+        cls.fprint = access.fprint
+        access.fprint = lambda x: None
+
+
+    @classmethod
+    def tearDownClass(cls):
+        access.fprint = cls.fprint
+        cls.fake.stop()
+
+
+    def setUp(self):
+        access.connect("001234", "password", self.base_url)
+
+
+    def test_connect(self):
+        self.assertTrue(access._aims_url.endswith("/aims/"))
+        self.assertNotEqual(access.get_index_page().find(
+            '\r\nvar notification = Trim("");\r\n'), -1)
+        with self.assertRaises(LogonError):
+            access.connect("001234", "wrong", self.base_url)
+
+
+    def test_brief_roster(self):
+        for offset in (0, -1, 1):
+            entries = parse.parse_brief_roster(
+                access.get_brief_roster(offset))
+            first, last = self.fake.period_days(self.fake.current + offset)
+            self.assertEqual(entries[0].aims_day, str(first))
+            self.assertEqual(entries[-1].aims_day, str(last))
+
+
+    def test_roster_navigation(self):
+        for jumps, requests_needed in ((True, 2), (False, 8)):
+            with FakeAims(months=13, current=6, jumps=jumps) as fake:
+                base_url = fake.start()
+                access.connect("001234", "password", base_url)
+                schedule = lambda: fake.requests[
+                    "POST /aims/perinfo.exe/schedule"]
+                html = access.get_brief_roster(-6)
+                self.assertEqual(html, fake.brief_roster(0))
+                self.assertEqual(schedule(), requests_needed)
+                self.assertEqual(access.get_brief_roster(-6), html)
+                self.assertEqual(access.get_brief_roster(0),
+                                 fake.brief_roster(6))
+                self.assertEqual(schedule(), requests_needed)
+                self.assertEqual(access.get_brief_roster(-5),
+                                 fake.brief_roster(1))
+                before = schedule()
+                #adjacent rosters are stepped to, not jumped to
+                access.connect("001234", "password", base_url)
+                self.assertEqual(access.get_brief_roster(1),
+                                 fake.brief_roster(7))
+                self.assertEqual(schedule() - before, 2)
+
+
+    def test_trips_and_crewlists(self):
+        (aims_day, trip_id), html = next(iter(self.fake.roster.trips.items()))
+        self.assertEqual(access.get_trip(aims_day, trip_id), html)
+        id_, html = next(iter(self.fake.roster.crewlists.items()))
+        self.assertEqual(access.get_crewlist(id_), html)
+        with self.assertRaises(requests.HTTPError):
+            access.get_crewlist("nonexistent")
+
+
+    def test_process(self):
+        entries = parse.parse_brief_roster(access.get_brief_roster(-1))
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch("aims.process.get_cache",
+                   lambda: cache.get_cache(tmp + "/cache", tmp + "/pickle")):
+            serial = process.process_roster_entries(entries, True, 1)
+            concurrent = process.process_roster_entries(entries, True, 4)
+        self.assertTrue(serial)
+        self.assertEqual(serial, concurrent)
+        self.assertTrue(any(X.sectors and X.sectors[0].crewlist for X in serial))
+
+
+    def test_retention_policy(self):
+        entries = parse.parse_brief_roster(access.get_brief_roster(-1))
+        policy = cache.RetentionPolicy(None, None, 2, None)
+        for policy_, expected in ((cache.DEFAULT_POLICY, 0), (policy, 2)):
+            with tempfile.TemporaryDirectory() as tmp:
+                get_cache = lambda: cache.get_cache(tmp + "/cache",
+                                                    tmp + "/pickle")
+                with patch("aims.process.get_cache", get_cache):
+                    process.process_roster_entries(entries, True,
+                                                   policy=policy_)
+                trip_cache = get_cache()
+                try:
+                    #the fake roster is too old for the default policy
+                    self.assertEqual(len(trip_cache["trips"]), expected)
+                finally:
+                    cache.save_cache(trip_cache)
+
+
+    def test_cache_stats_cover_all_periods(self):
+        periods = [parse.parse_brief_roster(access.get_brief_roster(X))
+                   for X in (-1, 0, 1)]
+        with tempfile.TemporaryDirectory() as tmp:
+            get_cache = lambda: cache.get_cache(tmp + "/cache",
+                                                tmp + "/pickle")
+            with patch("aims.process.get_cache", get_cache):
+                stats.reset()
+                process.process_roster_periods(periods, True)
+            misses = stats.snapshot()["counters"]["trip_cache_misses"]
+            trip_cache = get_cache()
+            try:
+                last_run = cache.cache_stats(trip_cache)
+            finally:
+                cache.save_cache(trip_cache)
+        self.assertGreater(misses, len(periods))
+        self.assertEqual(last_run["misses"], misses)
+
+
+    def test_retries(self):
+        policy = access.TransportPolicy(retries=10, backoff=0, jitter=0)
+        access._session.mount("http://", policy)
+        (aims_day, trip_id), html = next(iter(self.fake.roster.trips.items()))
+        trip = "GET /aims/perinfo.exe/schedule"
+        index = "GET /aims/perinfo.exe/index"
+        try:
+            self.fake.error_rate = 0.5
+            before = self.fake.requests[trip]
+            for _ in range(20):
+                self.assertEqual(access.get_trip(aims_day, trip_id), html)
+            self.assertGreater(self.fake.requests[trip] - before, 20)
+            #failing requests are retried, then reported
+            self.fake.error_rate = 1.0
+            before = self.fake.requests[index]
+            with self.assertRaises(requests.HTTPError):
+                access.get_index_page()
+            self.assertEqual(self.fake.requests[index] - before, 11)
+        finally:
+            self.fake.error_rate = 0.0
+        self.assertEqual(policy.timeout_for(self.base_url + "/aims/x"),
+                         (access.CONNECT_TIMEOUT, access.REQUEST_TIMEOUT))
+
+
+    def test_deadline(self):
+        #recent enough that the trip cache's retention policy keeps it
+        first_day = (datetime.date.today() - datetime.date(1980, 1, 1)).days - 90
+        with FakeAims(months=3, current=1, first_day=first_day) as fake, \
+             tempfile.TemporaryDirectory() as tmp, \
+             patch("aims.process.get_cache",
+                   lambda: cache.get_cache(tmp + "/cache", tmp + "/pickle")):
+            access.connect("001234", "password", fake.start())
+            entries = parse.parse_brief_roster(access.get_brief_roster(-1))
+            cached = process.process_roster_entries(entries, True)
+            access.set_deadline(0)
+            try:
+                with self.assertRaises(access.DeadlineExceeded):
+                    access.get_index_page()
+                #trips that cannot be downloaded come from the cache
+                stale = process.process_roster_entries(entries, True)
+            finally:
+                access.set_deadline(None)
+        self.assertTrue(cached)
+        self.assertEqual(stale, cached)
+
+
+    def test_deadline_with_retries(self):
+        with FakeAims(months=3, current=1) as fake:
+            access.connect("001234", "password", fake.start())
+            fake.latency = 2
+            access.set_deadline(1)
+            try:
+                start = time.monotonic()
+                #the first attempt times out and is not retried
+                with self.assertRaises(access.DeadlineExceeded):
+                    access.get_index_page()
+                self.assertLess(time.monotonic() - start, 1.5)
+                #failures are not retried after a long wait either
+                fake.latency, fake.error_rate = 0, 1.0
+                access._session.mount("http://", access.TransportPolicy(
+                    retries=10, backoff=10, jitter=0))
+                access.set_deadline(1)
+                start = time.monotonic()
+                with self.assertRaises(access.DeadlineExceeded):
+                    access.get_index_page()
+                self.assertLess(time.monotonic() - start, 0.5)
+            finally:
+                access.set_deadline(None)
+
+
+    def test_connection_reuse(self):
+        with FakeAims(months=3, current=1, gzip=True) as fake:
+            access.connect("001234", "password", fake.start(), 4)
+            trips = [(aims_day, trip_id, None)
+                     for aims_day, trip_id in fake.roster.trips]
+            stats.reset()
+            connections = fake.connections
+            sheets = process.fetch_trip_sheets(trips, 4)
+            self.assertLessEqual(fake.connections - connections, 4)
+        self.assertGreater(len(trips), 4)
+        self.assertEqual(sorted(sheets.values()),
+                         sorted(fake.roster.trips.values()))
+        wire, decoded = access.transfer_stats()["GET schedule"]
+        self.assertEqual(decoded, sum(len(X.encode()) for X in sheets.values()))
+        self.assertLess(wire, decoded)
+
+
+    def test_no_workers(self):
+        #a pool of zero connections would block the first request forever
+        access.connect("001234", "password", self.base_url, 0)
+        self.assertTrue(access.get_brief_roster())
+
+
+    def test_resume(self):
+        state = access.session_state()
+        access.connect("001234", "password", self.base_url)
+        self.assertIsNotNone(access.resume(state))
+        self.assertEqual(access._aims_url, state["aims_url"])
+        self.assertIsNone(access.resume(
+            {"cookies": {}, "aims_url": state["aims_url"]}))
+
+
+@unittest.skipIf(access_async is None, "aiohttp not installed")
+class TestAsyncAccess(unittest.TestCase):
+
+    def test_async_access(self):
+        async def run(base_url):
+            async with await access_async.connect(
+                    "001234", "password", base_url=base_url) as session:
+                index = await access_async.get_index_page(session)
+                rosters = [await access_async.get_brief_roster(session, X)
+                           for X in (-1, 0, 1)]
+            return index, rosters
+        with FakeAims(months=3, current=1) as fake, \
+             patch("aims.access.fprint", lambda x: None):
+            index, rosters = run_coroutine(run(fake.start()))
+            entries = parse.parse_brief_roster(rosters[-1])
+            self.assertEqual(entries[0].aims_day, str(fake.period_days(2)[0]))
+            self.assertEqual(rosters, [fake.brief_roster(X) for X in (0, 1, 2)])
+        self.assertNotEqual(index.find("var notification"), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+import datetime
+import os
+import pickle
+import tempfile
+import unittest
+
+from aims.mytypes import *
+import aims.cache as cache
+
+DT = datetime.datetime
+
+
+def _duties(trip_id):
+    return [Duty(DT(2019, 1, 1, 7), DT(2019, 1, 1, 12), trip_id, [])]
+
+
+class TestTripCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "aims.sqlite.v1")
+        self.pickle = os.path.join(self.tmp.name, "aims.pickle.v1")
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def test_round_trip(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        key = (datetime.date(2019, 1, 1), "B001")
+        self.assertIsNone(trip_cache["trips"].get(key))
+        trip_cache["trips"][key] = _duties("B001")
+        cache.save_cache(trip_cache)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        self.assertEqual(trip_cache["trips"][key], _duties("B001"))
+        self.assertEqual(list(trip_cache["trips"]), [key])
+        del trip_cache["trips"][key]
+        self.assertEqual(len(trip_cache["trips"]), 0)
+        cache.save_cache(trip_cache)
+
+
+    def test_prune(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        for day in (1, 2, 3):
+            trip_cache["trips"][(datetime.date(2019, 1, day), "B001")] = (
+                _duties("B001"))
+        self.assertEqual(
+            trip_cache["trips"].prune(datetime.date(2019, 1, 3)), 2)
+        self.assertEqual(list(trip_cache["trips"]),
+                         [(datetime.date(2019, 1, 3), "B001")])
+        cache.save_cache(trip_cache)
+
+
+    def test_sheets(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        aims_duties = [[("1,2,3", "401", "BRS", "GLA", "0855", "1010")]]
+        for day in (1, 2):
+            key = (datetime.date(2019, 1, day), "B001")
+            trip_cache["sheets"][key] = ("digest", aims_duties)
+        trip_cache["trips"][key] = _duties("B001")
+        cache.save_cache(trip_cache)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        self.assertEqual(trip_cache["sheets"][key], ("digest", aims_duties))
+        self.assertEqual(len(trip_cache["sheets"]), 2)
+        self.assertEqual(trip_cache["sheets"].prune_orphans(), 1)
+        self.assertEqual(list(trip_cache["sheets"]), [key])
+        cache.save_cache(trip_cache)
+
+
+    def test_crewlists(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        crewlist = [Crewmember("SMITH JOHN", "CP")]
+        self.assertNotIn("1,2,3", trip_cache["crewlists"])
+        trip_cache["crewlists"]["1,2,3"] = crewlist
+        cache.save_cache(trip_cache)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        self.assertIn("1,2,3", trip_cache["crewlists"])
+        self.assertEqual(trip_cache["crewlists"]["1,2,3"], crewlist)
+        self.assertEqual(trip_cache["crewlists"].prune(
+            datetime.date.today() - datetime.timedelta(days=1)), 0)
+        self.assertEqual(trip_cache["crewlists"].prune(
+            datetime.date.today() + datetime.timedelta(days=2)), 1)
+        self.assertEqual(len(trip_cache["crewlists"]), 0)
+        cache.save_cache(trip_cache)
+
+
+    def test_prune_cache(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        today = datetime.date(2019, 6, 1)
+        for date, trip_id in ((datetime.date(2017, 1, 1), "OLD"),
+                              (datetime.date(2019, 1, 1), "FINAL"),
+                              (datetime.date(2019, 1, 2), "NOTFINAL"),
+                              (datetime.date(2019, 5, 30), "RECENT")):
+            trip_cache["trips"][(date, trip_id)] = _duties(trip_id)
+        is_final = lambda duties: duties[0].text != "NOTFINAL"
+        removed = cache.prune_cache(trip_cache, cache.DEFAULT_POLICY,
+                                    is_final, today)
+        self.assertEqual(removed, 2)
+        self.assertEqual([X[1] for X in trip_cache["trips"]],
+                         ["FINAL", "RECENT"])
+        #only applied once per day unless forced
+        policy = cache.RetentionPolicy(max_entries=1)
+        self.assertEqual(
+            cache.prune_cache(trip_cache, policy, is_final, today), 0)
+        self.assertEqual(
+            cache.prune_cache(trip_cache, policy, is_final, today, True), 1)
+        self.assertEqual([X[1] for X in trip_cache["trips"]], ["RECENT"])
+        cache.save_cache(trip_cache)
+
+
+    def test_stats(self):
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        trip_cache["trips"][(datetime.date(2019, 1, 1), "B001")] = (
+            _duties("B001"))
+        trip_cache["last_run"] = {"hits": 3, "misses": 1}
+        cache.save_cache(trip_cache)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        stats = cache.cache_stats(trip_cache)
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]),
+                         (1, 3, 1))
+        self.assertEqual(stats["bytes"],
+                         len(pickle.dumps(_duties("B001"))))
+        self.assertGreater(stats["file_bytes"], 0)
+        cache.save_cache(trip_cache)
+
+
+    def test_no_writes_when_unchanged(self):
+        key = (datetime.date(2019, 1, 1), "B001")
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        trip_cache["trips"][key] = _duties("B001")
+        trip_cache["last_run"] = {"hits": 0, "misses": 1}
+        cache.save_cache(trip_cache)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        connection = trip_cache["trips"].connection
+        trip_cache["trips"][key] = _duties("B001")
+        trip_cache["trips"].set_meta(hits=0, misses=1)
+        self.assertEqual(connection.total_changes, 0)
+        trip_cache["trips"][key] = _duties("B002")
+        self.assertEqual(connection.total_changes, 1)
+        self.assertFalse(connection.in_transaction)
+        cache.save_cache(trip_cache)
+
+
+    def test_pickle_migration(self):
+        key = (datetime.date(2019, 1, 1), "B001")
+        with open(self.pickle, "wb") as f:
+            pickle.dump({"trips": {key: _duties("B001")}}, f)
+        trip_cache = cache.get_cache(self.db, self.pickle)
+        self.assertEqual(trip_cache["trips"][key], _duties("B001"))
+        self.assertFalse(os.path.exists(self.pickle))
+        self.assertTrue(os.path.exists(self.pickle + ".migrated"))
+        cache.save_cache(trip_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import argparse
+import datetime
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from aims.mytypes import *
+import aims.access as access
+import aims.aims as cli
+import aims.output as output
+import aims.json_format as json_format
+import aims.roster_format as roster_format
+from benchmarks.fake_aims import FakeAims
+
+DT = datetime.datetime
+
+
+class TestOutputs(unittest.TestCase):
+
+    dutylist = [
+        Duty(DT(2019, 1, 2, 5), DT(2019, 1, 2, 13), "ESBY", None),
+        Duty(DT(2019, 1, 1, 5), DT(2019, 1, 1, 13), "ADTY", None),
+    ]
+
+
+    def test_out_argument(self):
+        self.assertEqual(cli._out("ical=roster.ics"), ("ical", "roster.ics"))
+        self.assertEqual(cli._out("json=a=b.json"), ("json", "a=b.json"))
+        for bad in ("ical", "ical=", "changes=x", "bad=x"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cli._out(bad)
+
+
+    def test_workers_argument(self):
+        self.assertEqual(cli._workers("4"), 4)
+        for bad in ("0", "-1", "x"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cli._workers(bad)
+
+
+    def test_render(self):
+        dutylist = list(self.dutylist)
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            path = os.path.join(tmp, "roster.json")
+            output.render(dutylist, [("roster", None), ("json", path)], None)
+            with open(path) as f:
+                self.assertEqual(f.read(), json_format.dump(dutylist) + "\n")
+        self.assertEqual(stdout.getvalue(),
+                         roster_format.dump(dutylist) + "\n")
+        self.assertEqual(dutylist, self.dutylist)
+
+
+
+    @unittest.skipUnless(os.name == "posix", "needs Unix permissions")
+    def test_write_atomic_mode(self):
+        umask = os.umask(0o027)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "roster.ics")
+                output.write_atomic(path, "new")
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+                os.chmod(path, 0o644)
+                output.write_atomic(path, "replaced")
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+                with open(path) as f:
+                    self.assertEqual(f.read(), "replaced")
+        finally:
+            os.umask(umask)
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_password_time_not_counted(self):
+        def slow_getpass():
+            time.sleep(1)
+            return "password"
+        with FakeAims(months=3, current=1) as fake, \
+             patch("aims.aims.getpass", slow_getpass), \
+             patch("aims.access.fprint", lambda x: None), \
+             patch("sys.stdout", new_callable=io.StringIO) as stdout, \
+             patch("sys.argv", ["aims", "changes", "001234", "--base_url",
+                                fake.start(), "--deadline", "0.5"]):
+            try:
+                cli.main()
+            finally:
+                access.set_deadline(None)
+        self.assertEqual(stdout.getvalue(), "No changes\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+import unittest
+import datetime
+import json
+
+from aims.mytypes import *
+import aims.json_format as json_format
+
+DT = datetime.datetime
+
+
+class TestJsonFormat(unittest.TestCase):
+
+    dutylist = [
+        Duty(DT(2019, 1, 1, 7), DT(2019, 1, 1, 12), "B001", [
+            Sector("1", "BRS", "NCL",
+                   DT(2019, 1, 1, 8), DT(2019, 1, 1, 9),
+                   DT(2019, 1, 1, 8), DT(2019, 1, 1, 9),
+                   "G-TEST", pax=False,
+                   crewlist=[Crewmember("SMITH JOHN", "CP")])]),
+        Duty(DT(2019, 1, 2, 5), DT(2019, 1, 2, 13), "ESBY\nx", None),
+    ]
+
+
+    def test_matches_json_dumps(self):
+        for dutylist in (self.dutylist, self.dutylist[:1], []):
+            self.assertEqual(
+                json_format.dump(dutylist),
+                json.dumps(dutylist, sort_keys=True, indent=4,
+                           default=lambda x: x.__str__()))
+
+
+    def test_streams(self):
+        pieces = json_format.iter_dump(iter(self.dutylist))
+        self.assertTrue(next(pieces).startswith("[\n    [\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -80,23 +80,27 @@ class TestBriefRosterParsing(unittest.TestCase):
         entries = aims.parse.parse_brief_roster(data)
         self.assertEqual(entries, [
             RosterEntry(aims_day='14146',
-                        items=['CSBE', '3:00', '5:00', 'B006D']),
-            RosterEntry(aims_day='14147', items=['B086']),
-            RosterEntry(aims_day='14150', items=['D/O']),
-            RosterEntry(aims_day='14153', items=['LVE']),
-            RosterEntry(aims_day='14157', items=['==>', 'B253']),
-            RosterEntry(aims_day='14162', items=['ADTY', '5:00', '11:00']),
-            RosterEntry(aims_day='14174', items=['FTGD']),
+                        items=('CSBE', '3:00', '5:00', 'B006D')),
+            RosterEntry(aims_day='14147', items=('B086',)),
+            RosterEntry(aims_day='14150', items=('D/O',)),
+            RosterEntry(aims_day='14153', items=('LVE',)),
+            RosterEntry(aims_day='14157', items=('==>', 'B253')),
+            RosterEntry(aims_day='14162', items=('ADTY', '5:00', '11:00')),
+            RosterEntry(aims_day='14174', items=('FTGD',)),
             RosterEntry(aims_day='13869',
-                        items = ['FIRE', '8:00', '9:30',
+                        items = ('FIRE', '8:00', '9:30',
                                  'DOOR', '9:30', '10:45',
                                  'G/S', '10:45', '11:30',
                                  'ASEC', '11:30', '13:00',
                                  'CRM', '13:00', '14:00',
                                  'SEP', '14:00', '16:00',
-                                 '89']),
-            RosterEntry(aims_day='14036', items=['B001T', '6']),
+                                 '89')),
+            RosterEntry(aims_day='14036', items=('B001T', '6')),
             ])
+        again = aims.parse.parse_brief_roster(data)
+        self.assertEqual(again, entries)
+        self.assertIsNot(again, entries)
+        self.assertIs(again[0], entries[0])
 
 
     def test_bad_brief_roster(self):
@@ -254,6 +258,45 @@ class TestCrewParsing(unittest.TestCase):
                 Crewmember(name='Salt Beverly', role='FA')])
 
 
+    def test_fast_crewlist(self):
+        data = """\
+<html><body><table>
+<tr class='sub_table_header'>
+<td>ID</td><td>Name</td><td>Seniority</td><td>Base</td><td>AC</td>
+<td>Pos</td><td>Trn Duty</td><td>Trip</td><td>PAX</td></tr>
+<tr class="dual_rows"><td>9448</td><td>O&#39;HURST <b>JON</b></td><td></td>
+<td>BRS</td><td>320</td><td>CP</td><td>&nbsp;</td><td>B036</td><td>&nbsp;</td></tr>
+</tr><tr class="dual_rows"><td>820596</td><td>POSITIONER IAMA</td><td></td>
+<td>BRS</td><td>320</td><td>FA</td><td>&nbsp;</td><td>B036</td><td>*</td></tr>
+</table>
+<table><tr><td>Not crew</td></tr></table>
+</body></html>
+"""
+        crewlist = aims.parse._fast_parse_crewlist(data)
+        self.assertEqual(crewlist, [Crewmember("O'Hurst Jon", "CP")])
+        self.assertEqual(crewlist, aims.parse._full_parse_crewlist(data))
+        self.assertIsNone(aims.parse._fast_parse_crewlist(
+            data.replace("<td>*</td>", "")))
+
+
+    def test_crewlist_verify(self):
+        messages = []
+        orig = (aims.parse._fast_parse_crewlist, aims.access.fprint)
+        aims.parse._fast_parse_crewlist = lambda html: []
+        aims.access.fprint = messages.append
+        try:
+            data = """\
+<table><tr class="sub_table_header"><td>ID</td></tr>
+<tr><td>1</td><td>A B</td><td></td><td></td><td></td>
+<td>FO</td><td></td><td></td><td></td></tr></table>"""
+            self.assertEqual(aims.parse.parse_crewlist(data), [])
+            self.assertEqual(aims.parse.parse_crewlist(data, verify=True),
+                             [Crewmember("A B", "FO")])
+        finally:
+            aims.parse._fast_parse_crewlist, aims.access.fprint = orig
+        self.assertEqual(len(messages), 1)
+
+
     def test_bad_crewlist(self):
         with self.assertRaises(BadCrewList):
             aims.parse.parse_crewlist("Not HTML")
@@ -262,5 +305,35 @@ class TestCrewParsing(unittest.TestCase):
                 "<html><body><p>Not crewlist</p></body></html>")
 
 
+class _BackendMixin:
+
+    backend = None
+
+    def setUp(self):
+        aims.parse.set_backend(self.backend)
+
+
+    def tearDown(self):
+        aims.parse.set_backend(None)
+
+
+#run all the parsing tests against every available backend
+for _backend in aims.parse.available_backends():
+    for _case in (TestBriefRosterParsing, TestTripParsing, TestCrewParsing):
+        _name = "{}_{}".format(_case.__name__,
+                               _backend.replace(".", "_"))
+        globals()[_name] = type(_name, (_BackendMixin, _case),
+                                {"backend": _backend})
+del _case
+
+
+class TestBackendSelection(unittest.TestCase):
+
+    def test_bad_backend(self):
+        with self.assertRaises(ValueError):
+            aims.parse.set_backend("no such parser")
+        self.assertIn(aims.parse.get_backend(), aims.parse.BACKENDS)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,44 +2,65 @@
 
 import unittest
 import datetime
-import os
-import pickle
+import random
+import re
+from unittest.mock import patch
+
+import requests
 
 from aims.mytypes import *
 import aims.access as access
 import aims.parse as parse
 import aims.process as process
 
+#A trip sheet of two flown sectors
+TRIP_SHEET = """\
+<html><body><table>
+<tr class="mono_rows_ctrl_f3" id="1,2,3,401,brs,1, ,gla,320">
+<td>401 BRS GLA 0855 1010 Fri1Jan 1 A0900 A1009 OE-IVK 1:09 07:55</td></tr>
+<tr class="mono_rows_ctrl_f3" id="1,2,3,402,gla,1, ,brs,320">
+<td>402 GLA BRS 1035 1145 Fri1Jan 1 A1040 A1145 OE-IVK 1:05 12:15</td></tr>
+</table></body></html>"""
+
 
 class TestBriefRosterProcessing(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.orig_get_trip_duties = process.get_trip_duties
-        process.get_trip_duties = cls.get_trip_duties_patch
+        cls.orig = (process.refresh_trips, process.get_cache,
+                    process.save_cache, process.prune_cache)
+        process.refresh_trips = cls.refresh_trips_patch
+        process.get_cache = lambda: {"trips": {}}
+        process.save_cache = lambda cache: None
+        process.prune_cache = lambda *args: 0
 
 
     @classmethod
     def tearDownClass(cls):
-        process.get_trip_duties = cls.orig_get_trip_duties
+        (process.refresh_trips, process.get_cache,
+         process.save_cache, process.prune_cache) = cls.orig
 
 
     @staticmethod
-    def get_trip_duties_patch(aims_day: str,
-                    trip_id: str,
-                    date: datetime.date,
-                    cache: dict,
-                    force: bool = False
-    ) -> List[Duty]:
-        if aims_day == '14158' and trip_id == '89':
-            return [Duty(datetime.datetime.combine(date, dt.time(7)),
-                     datetime.datetime.combine(date, dt.time(20)),
-                     aims_day + trip_id,
-                         None)]
-        return [Duty(datetime.datetime.combine(date, dt.time(0)),
-                     datetime.datetime.combine(date, dt.time(1)),
-                     aims_day + trip_id,
-                     None)]
+    def refresh_trips_patch(trips: list,
+                            cache: dict,
+                            force: bool = False,
+                            workers: int = 1
+    ) -> dict:
+        trip_duties = {}
+        for aims_day, trip_id, date in trips:
+            if aims_day == '14158' and trip_id == '89':
+                duty = Duty(datetime.datetime.combine(date, dt.time(7)),
+                            datetime.datetime.combine(date, dt.time(20)),
+                            aims_day + trip_id,
+                            None)
+            else:
+                duty = Duty(datetime.datetime.combine(date, dt.time(0)),
+                            datetime.datetime.combine(date, dt.time(1)),
+                            aims_day + trip_id,
+                            None)
+            trip_duties[(date, trip_id)] = [duty]
+        return trip_duties
 
 
     def test_roster_processing(self):
@@ -78,6 +99,189 @@ class TestBriefRosterProcessing(unittest.TestCase):
         ])
 
 
+    def test_roster_periods(self):
+        received = []
+        def periods():
+            for period in (
+                    [RosterEntry('14146', ['B001']),
+                     RosterEntry('14147', ['D/O'])],
+                    [RosterEntry('14147', ['D/O']),
+                     RosterEntry('14148', ['==>']),
+                     RosterEntry('14149', ['B002'])],
+                    [RosterEntry('14145', ['B000']),
+                     RosterEntry('14150', ['B002'])]):
+                received.append(len(period))
+                yield period
+        duties = process.process_roster_periods(periods())
+        self.assertEqual(received, [2, 3, 2])
+        self.assertEqual([X.text for X in duties],
+                         ['14146B001', '14149B002', '14150B002'])
+
+
+    def test_duty_order(self):
+        entries = [RosterEntry('14146', ['B006D', 'CSBE', '3:00', '5:00'])]
+        #as process_roster_entries() has always returned them
+        self.assertEqual(
+            [X.text for X in process.process_roster_entries(entries)],
+            ['CSBE', '14146B006D'])
+        self.assertEqual(
+            [X.text for X in process.iter_duties(entries, sort=True)],
+            ['14146B006D', 'CSBE'])
+
+
+    def test_iter_duties(self):
+        consumed = []
+        def entries():
+            for day in range(14146, 14151):
+                consumed.append(day)
+                yield RosterEntry(str(day), ['B{}'.format(day)])
+        duties = process.iter_duties(entries(), window=2)
+        self.assertEqual(next(duties).text, '14146B14146')
+        self.assertEqual(consumed, [14146, 14147])
+        self.assertEqual([X.text for X in duties],
+                         ['14147B14147', '14148B14148',
+                          '14149B14149', '14150B14150'])
+
+
+class TestTripFetching(unittest.TestCase):
+
+    def setUp(self):
+        #the trip sheet served for every trip, or None to serve
+        #aims_day + trip_id
+        self.sheet = None
+        self.trip_calls = []
+        self.crew_calls = []
+        self.crew_failing = False
+        def get_trip_patch(aims_day, trip_id):
+            self.trip_calls.append((aims_day, trip_id))
+            return self.sheet or aims_day + trip_id
+        def get_crewlist_patch(id_):
+            if self.crew_failing: raise requests.ConnectionError()
+            self.crew_calls.append(id_)
+            return id_
+        for patch_ in (
+                patch("aims.access.get_trip", get_trip_patch),
+                patch("aims.access.get_crewlist", get_crewlist_patch),
+                patch("aims.parse.parse_crewlist",
+                      lambda html: [Crewmember(html, "CP")]),
+                patch("aims.access.fprint", lambda x: None)):
+            patch_.start()
+            self.addCleanup(patch_.stop)
+
+
+    @staticmethod
+    def refresh(cache, date, force=False):
+        return process.refresh_trips([('7305', 'B001', date)], cache,
+                                     force)[(date, 'B001')]
+
+
+    def test_fetch_trip_sheets(self):
+        d1, d2 = dt.date(2018, 9, 24), dt.date(2018, 9, 25)
+        trips = [('14146', 'B006D', d1), ('14147', 'B086', d2),
+                 ('14146', 'B006D', d1)]
+        for workers in (1, 4):
+            self.trip_calls.clear()
+            result = process.fetch_trip_sheets(trips, workers)
+            self.assertEqual(result, {(d1, 'B006D'): '14146B006D',
+                                      (d2, 'B086'): '14147B086'})
+            self.assertEqual(sorted(self.trip_calls),
+                             [('14146', 'B006D'), ('14147', 'B086')])
+
+
+    def test_refresh_trips(self):
+        #the second sector is positioning
+        self.sheet = TRIP_SHEET.replace("Fri1Jan 1 A1040", "PAX A1040")
+        date = dt.date(2000, 1, 1)
+        cache = {"trips": {}}
+        result = process.refresh_trips(
+            [('7305', 'B001', date), ('7305', 'B001', date)], cache)
+        self.assertEqual(self.crew_calls, ["1,2,3,401,brs,1, ,gla,320"])
+        duties = result[(date, 'B001')]
+        self.assertEqual(cache["trips"][(date, 'B001')], duties)
+        self.assertEqual(
+            [X.crewlist for X in duties[0].sectors],
+            [[Crewmember("1,2,3,401,brs,1, ,gla,320", "CP")], []])
+
+
+    def test_refresh_trips_unchanged_sheets(self):
+        self.sheet = TRIP_SHEET
+        #recent enough that missing actual times are still checked for
+        date = dt.datetime.utcnow().date() - dt.timedelta(days=2)
+        cache = {"trips": {}}
+        def refresh():
+            #make the cached duties look as if actual times are missing
+            duties = cache["trips"][(date, 'B001')]
+            cache["trips"][(date, 'B001')] = [duties[0]._replace(
+                sectors=[X._replace(on=None) for X in duties[0].sectors])]
+            self.crew_calls.clear()
+            parse_trip_details.reset_mock()
+            return self.refresh(cache, date)
+        with patch("aims.parse.parse_trip_details",
+                   wraps=parse.parse_trip_details) as parse_trip_details:
+            first = self.refresh(cache, date)
+            self.assertEqual(len(self.crew_calls), 2)
+            #identical sheet: cached duties are used as they are
+            self.assertEqual(refresh()[0].sectors[0].on, None)
+            self.assertEqual(self.crew_calls, [])
+            self.assertEqual(parse_trip_details.call_count, 0)
+            #second sector changed: only its crew list is downloaded
+            self.sheet = TRIP_SHEET.replace("A1145", "A1146")
+            cache["crewlists"].clear()
+            duties = refresh()
+            self.assertEqual(self.crew_calls, ["1,2,3,402,gla,1, ,brs,320"])
+            self.assertEqual(parse_trip_details.call_count, 1)
+            self.assertEqual(duties[0].sectors[0], first[0].sectors[0])
+            #forced: everything is downloaded again
+            self.crew_calls.clear()
+            self.refresh(cache, date, True)
+            self.assertEqual(len(self.crew_calls), 2)
+
+
+    def test_refresh_trips_retries_failed_sheet(self):
+        date = dt.datetime.utcnow().date() - dt.timedelta(days=2)
+        cache = {"trips": {}}
+        #the second sector has not been flown yet
+        self.sheet = TRIP_SHEET.replace(" A1040 A1145", "")
+        self.assertIsNone(self.refresh(cache, date)[0].sectors[1].on)
+        #it has now, but its crew list cannot be downloaded...
+        self.sheet = TRIP_SHEET
+        self.crew_failing = True
+        self.assertIsNone(self.refresh(cache, date)[0].sectors[1].on)
+        #...so the same sheet is processed again next time
+        self.crew_failing = False
+        self.assertEqual(self.refresh(cache, date)[0].sectors[1].on,
+                         dt.datetime.combine(date, dt.time(11, 45)))
+
+
+    def test_crewlist_cache(self):
+        sector = ["1,2,3,401,brs,1, ,gla,320", "401", "BRS", "GLA",
+                  "0855", "1010", "A0900", "A1009"]
+        date = dt.date(2000, 1, 1)
+        crew_cache = {} # type: Dict[str, List[Crewmember]]
+        for _ in range(2):
+            result = process.process_aims_sector(sector, date, None,
+                                                 crew_cache)
+        self.assertEqual(self.crew_calls, [sector[0]])
+        self.assertEqual(crew_cache, {sector[0]: result.crewlist})
+        #unflown sectors are not cached
+        process.process_aims_sector(sector[:6], date, None, crew_cache)
+        self.assertEqual(len(crew_cache), 1)
+
+
+    def test_entry_items_not_modified(self):
+        entry = RosterEntry(aims_day='14146',
+                            items=('CSBE', '3:00', '5:00', 'B006D', 'D/O'))
+        for _ in range(2):
+            items = list(process._entry_items(entry, dt.date(2018, 9, 24)))
+            self.assertEqual(items, [
+                'B006D',
+                Duty(datetime.datetime(2018, 9, 24, 3), datetime.datetime(2018, 9, 24, 5),
+                     'CSBE', None)])
+        with self.assertRaises(IndexError):
+            list(process._entry_items(RosterEntry('14146', ('3:00', '5:00')),
+                                      dt.date(2018, 9, 24)))
+
+
 class TestSectorProcessing(unittest.TestCase):
 
     @classmethod
@@ -213,13 +417,120 @@ class TestSectorProcessing(unittest.TestCase):
             process.process_aims_sector(data, None)
 
 
+    @staticmethod
+    def reference_sector(aims_sector, date):
+        #the regex and strptime based decoding that process_aims_sector
+        #used to do, kept to check that the faster decoding is identical
+        try:
+            id_, flightnum, from_, to, sched_off, sched_on = aims_sector[:6]
+        except:
+            raise BadAIMSSector(str(aims_sector))
+        off, on, reg, pax = (None,) * 3 + (False,)
+        for field in aims_sector[6:]:
+            if re.match(r"A\d{4}", field):
+                if not off: off = field[1:]
+                else: on = field[1:]
+            elif re.match(r"\w{1,2}-\w{3,5}", field):
+                reg = field
+            elif field == "PAX":
+                pax = True
+        try:
+            sched_off, sched_on = (X + "+0" if len(X) == 4 else X
+                                   for X in (sched_off, sched_on))
+            sched_off_t, sched_on_t = (
+                dt.datetime.strptime(X[:4], "%H%M").time()
+                for X in (sched_off, sched_on))
+            sched_off_dt = (dt.datetime.combine(date, sched_off_t)
+                            + dt.timedelta(days=int(sched_off[5])))
+            sched_on_dt = (dt.datetime.combine(date, sched_on_t)
+                           + dt.timedelta(days=int(sched_on[5])))
+            off_dt, on_dt = None, None
+            if on:
+                off_dt, on_dt = (
+                    dt.datetime.combine(
+                        date, dt.datetime.strptime(X[:4], "%H%M").time())
+                    for X in (off, on))
+                if sched_off_dt - off_dt > dt.timedelta(days=1) / 2:
+                    off_dt += dt.timedelta(days=1)
+                if sched_on_dt - on_dt > dt.timedelta(days=1) / 2:
+                    on_dt += dt.timedelta(days=1)
+        except:
+            raise BadAIMSSector(str(date) + ", " + str(aims_sector))
+        crewlist = [Crewmember("c", "CP")] if on and not pax else []
+        if not id_:
+            flightnum = "[{}]".format(flightnum)
+        return Sector(flightnum, from_, to, sched_off_dt, sched_on_dt,
+                      off_dt, on_dt, reg, pax, crewlist)
+
+
+    def test_decoding_matches_reference(self):
+        rnd = random.Random(0)
+        digits = "0123456789" * 4 + "\u0661\u0662\u0663\u0669"
+        def hhmm():
+            if rnd.random() < 0.9:
+                return "{:02d}{:02d}".format(rnd.randrange(24),
+                                             rnd.randrange(60))
+            return "".join(rnd.choice(digits + ":x ")
+                           for _ in range(rnd.choice((3, 4, 4, 5))))
+        def sched():
+            return hhmm() + rnd.choice(("", "", "", "+1", "+0", "+", "+x",
+                                        "-1", "+12"))
+        def field():
+            return rnd.choice((
+                lambda: "A" + hhmm(),
+                lambda: "A" + hhmm() + rnd.choice(("", "0", "+1")),
+                lambda: rnd.choice(("G", "OE", "HB", "g1", "G_"))
+                        + rnd.choice("--_") + rnd.choice(
+                            ("EZDL", "IJU", "EZAB1", "EZ", "E\u00c9Z")),
+                lambda: rnd.choice(("PAX", "pax", "PAXX", "Wed20Feb", "1",
+                                    "11:35", "", "A", "a1234")),
+            ))()
+        failures = 0
+        for _ in range(20000):
+            sector = [rnd.choice(("", "14293,353365012537")),
+                      rnd.choice(("8496", "esby")), "OPO", "LGW",
+                      sched(), sched()]
+            sector += [field() for _ in range(rnd.randrange(7))]
+            date = dt.date(2000, 1, 1) + dt.timedelta(rnd.randrange(366))
+            try:
+                expected = self.reference_sector(sector, date)
+            except BadAIMSSector:
+                failures += 1
+                with self.assertRaises(BadAIMSSector, msg=sector):
+                    process.process_aims_sector(sector, date)
+                continue
+            self.assertEqual(process.process_aims_sector(sector, date),
+                             expected, sector)
+        #both outcomes are well exercised
+        self.assertTrue(2000 < failures < 18000)
+
+
+    def test_time_parsers(self):
+        rnd = random.Random(0)
+        for _ in range(20000):
+            str_ = "".join(rnd.choice("0123456789:\u0662 ")
+                           for _ in range(rnd.randrange(7)))
+            if rnd.random() < 0.5:
+                str_ = "{}:{}".format(str(rnd.randrange(30))[:2],
+                                      str_[:2] or "0")
+            for func, format_ in ((process._hhmm, "%H%M"),
+                                  (process._h_mm, "%H:%M")):
+                try:
+                    expected = dt.datetime.strptime(str_, format_).time()
+                except ValueError:
+                    with self.assertRaises(ValueError, msg=str_):
+                        func(str_)
+                else:
+                    self.assertEqual(func(str_), expected, str_)
+
+
 class TestDutyProcessing(unittest.TestCase):
 
 
     @classmethod
     def setUpClass(cls):
         cls.old_process_aims_sector = process.process_aims_sector
-        process.process_aims_sector = lambda s, d: Sector(
+        process.process_aims_sector = lambda s, d, c=None, cc=None: Sector(
             "test", "a", "b",
             dt.datetime(2000, 1, 1), dt.datetime(2000, 1, 1, 1),
             dt.datetime(2000, 1, 1), dt.datetime(2000, 1, 1, 1),
@@ -427,6 +738,25 @@ class TestCaching(unittest.TestCase):
         self.assertEqual(process._requires_update(data), False)
 
 
+    def test_is_stale(self):
+        data = [
+            _make_duty([
+            _make_sector(dt.datetime(2000, 1, 1, 8, 55)),
+            _make_sector(dt.datetime(2000, 1, 1, 10, 30), no_actuals=True),
+            ])]
+        self.assertEqual(process._is_stale(None), True)
+        #scheduled on at 11:30, within grace period
+        fakeDatetime.now = dt.datetime(2000, 1, 1, 11, 45)
+        self.assertEqual(process._is_stale(data), False)
+        fakeDatetime.now = dt.datetime(2000, 1, 1, 12, 1)
+        self.assertEqual(process._is_stale(data), True)
+        #given up on, but still not final for pruning purposes
+        fakeDatetime.now = dt.datetime(2000, 1, 9)
+        self.assertEqual(process._is_stale(data), False)
+        self.assertEqual(process._requires_update(data), False)
+        self.assertEqual(process._is_final(data), False)
+
+
 
 if __name__ == '__main__':
     unittest.main()
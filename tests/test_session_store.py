@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+import os
+import stat
+import tempfile
+import unittest
+
+import aims.session_store as session_store
+
+
+@unittest.skipUnless(session_store.available(), "cryptography not installed")
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.orig = (session_store.SESSION_DIRECTORY, session_store.KEY_FILE)
+        session_store.SESSION_DIRECTORY = self.tmp.name
+        session_store.KEY_FILE = os.path.join(self.tmp.name, "conf", "key")
+
+
+    def tearDown(self):
+        session_store.SESSION_DIRECTORY, session_store.KEY_FILE = self.orig
+        self.tmp.cleanup()
+
+
+    def test_round_trip(self):
+        self.assertIsNone(session_store.load("001234"))
+        state = {"cookies": {"a": "b"}, "aims_url": "https://aims/"}
+        session_store.save("001234", state)
+        self.assertEqual(session_store.load("001234"), state)
+        self.assertIsNone(session_store.load("004321"))
+        session_store.delete("001234")
+        self.assertIsNone(session_store.load("001234"))
+
+
+    def test_encrypted_and_private(self):
+        session_store.save("001234", {"aims_url": "https://aims/"})
+        filename = session_store._session_file("001234")
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read().find(b"https://aims/"), -1)
+        for name in (filename, session_store.KEY_FILE):
+            self.assertEqual(stat.S_IMODE(os.stat(name).st_mode), 0o600)
+
+
+    def test_corrupt_file(self):
+        with open(session_store._session_file("001234"), "wb") as f:
+            f.write(b"rubbish")
+        self.assertIsNone(session_store.load("001234"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import aims.spans as spans
+
+
+class TestSpans(unittest.TestCase):
+
+    def tearDown(self):
+        spans.disable()
+
+
+    def test_disabled(self):
+        self.assertFalse(spans.enabled())
+        self.assertIs(spans.span("a"), spans.span("b"))
+        with spans.span("a"):
+            pass
+        self.assertEqual(spans.disable(), [])
+
+
+    def test_trace(self):
+        spans.enable()
+        with spans.span("outer"):
+            with spans.span("inner"):
+                pass
+            def work():
+                with spans.span("x"):
+                    pass
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        events = spans.disable()
+        with spans.span("ignored"):
+            pass
+        complete = {X["name"]: X for X in events if X["ph"] == "X"}
+        self.assertEqual(set(complete), {"outer", "inner", "x"})
+        outer, inner = complete["outer"], complete["inner"]
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"],
+                                inner["ts"] + inner["dur"])
+        self.assertEqual(outer["tid"], inner["tid"])
+        self.assertNotEqual(complete["x"]["tid"], outer["tid"])
+        #each thread is named once
+        self.assertEqual(len([X for X in events if X["ph"] == "M"]), 2)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            spans.write_trace(path, events)
+            with open(path) as f:
+                self.assertEqual(json.load(f)["traceEvents"], events)
+
+
+if __name__ == "__main__":
+    unittest.main()
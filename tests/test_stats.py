@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+import json
+import unittest
+
+import aims.access as access
+import aims.stats as stats
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        stats.reset()
+
+
+    def tearDown(self):
+        stats.reset()
+
+
+    def test_record_request(self):
+        stats.record_request("GET schedule", 0.3, 100, 400)
+        stats.record_request("GET schedule", 45, ok=False)
+        stats.count("trip_cache_hits", 3)
+        stats.count("trip_cache_misses", 0)
+        snapshot = stats.snapshot()
+        endpoint = snapshot["endpoints"]["GET schedule"]
+        self.assertEqual(
+            (endpoint["requests"], endpoint["errors"], endpoint["wire_bytes"],
+             endpoint["bytes"], endpoint["max_seconds"]),
+            (2, 1, 100, 400, 45))
+        self.assertEqual(endpoint["histogram"],
+                         [0, 0, 0, 1, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(snapshot["counters"], {"trip_cache_hits": 3})
+        self.assertEqual(json.loads(stats.dumps(snapshot)), snapshot)
+        table = stats.table(snapshot).splitlines()
+        self.assertTrue(table[1].startswith("GET schedule"))
+        self.assertEqual(table[-1].split(), ["trip_cache_hits", "3"])
+
+
+    def test_percentile(self):
+        self.assertEqual(stats.percentile([8, 1, 1] + [0] * 7, 0.9), 0.1)
+        self.assertEqual(stats.percentile([1] + [0] * 8 + [9], 0.9), None)
+
+
+    def test_endpoint(self):
+        for method, url, name in (
+                ("GET", "https://x/aims/perinfo.exe/getlegmem", "GET getlegmem"),
+                ("POST", "https://x/saml/idp", "POST saml"),
+                ("GET", "https://x/", "GET signon")):
+            self.assertEqual(access._endpoint(method, url), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import datetime
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import aims.access as access
+import aims.watch as watch
+from aims.mytypes import *
+from benchmarks.fake_aims import FakeAims
+
+TRIP = "GET /aims/perinfo.exe/schedule"
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [
+            patch("aims.cache.CACHE_FILE", os.path.join(self.tmp.name, "c")),
+            patch("aims.cache.PICKLE_CACHE_FILE",
+                  os.path.join(self.tmp.name, "p")),
+            patch("aims.access.fprint", lambda x: None),
+        ]
+        for p in self.patches: p.start()
+
+
+    def tearDown(self):
+        for p in self.patches: p.stop()
+        self.tmp.cleanup()
+
+
+    def test_next_delay(self):
+        rnd = random.Random(0)
+        for _ in range(20):
+            self.assertTrue(
+                80 <= watch.next_delay(100, 0.2, 0, 1000, rnd) <= 120)
+        self.assertEqual(watch.next_delay(100, 0, 3, 1000), 800)
+        self.assertEqual(watch.next_delay(100, 0, 4, 1000), 1000)
+        self.assertEqual(watch.next_delay(100, 0, 4, 10), 100)
+
+
+    def test_changed_trips(self):
+        old = [RosterEntry('14146', ('B001',)),
+               RosterEntry('14147', ('==>',)),
+               RosterEntry('14148', ('B002',)),
+               RosterEntry('14149', ('B003',))]
+        new = [RosterEntry('14146', ('B001',)),
+               RosterEntry('14147', ('D/O',)),
+               RosterEntry('14148', ('B002',)),
+               RosterEntry('14149', ('B004',))]
+        self.assertEqual(watch.changed_trips(old, new), {
+            (datetime.date(2018, 9, 24), 'B001'),
+            (datetime.date(2018, 9, 27), 'B004')})
+
+
+    def test_watch(self):
+        #recent enough that the trip cache's retention policy keeps it
+        first_day = (datetime.date.today() - datetime.date(1980, 1, 1)).days - 90
+        with FakeAims(months=3, current=1, first_day=first_day) as fake:
+            url = fake.start()
+            path = os.path.join(self.tmp.name, "roster.txt")
+            connects = []
+            def connect():
+                connects.append(url)
+                access.connect("001234", "password", url)
+            watcher = watch.Watcher(connect, [("roster", path)])
+            run = lambda: watcher.run(polls=1)
+            run()
+            with open(path) as f:
+                roster = f.read()
+            self.assertTrue(roster)
+            fetched = fake.requests[TRIP]
+            self.assertTrue(fetched)
+            #pending changes: nothing is downloaded
+            fake.changes = True
+            os.remove(path)
+            run()
+            self.assertFalse(os.path.exists(path))
+            #changes acknowledged: only the changed trip is downloaded
+            first, last = fake.period_days(fake.current)
+            i, (aims_day, items) = next(
+                (i, X) for i, X in enumerate(fake.roster.days)
+                if X[0] >= first and X[1][0].startswith("B"))
+            fake.roster.trips[(str(aims_day), "B999")] = fake.roster.trips[
+                (str(aims_day), items[0])]
+            fake.roster.days[i] = (aims_day, ["B999"])
+            fake.changes = False
+            run()
+            self.assertEqual(fake.requests[TRIP], fetched + 1)
+            with open(path) as f:
+                self.assertEqual(f.read(), roster)
+            #an expired session is replaced
+            fake.sessions.clear()
+            run()
+            self.assertEqual(len(connects), 2)
+            self.assertEqual(os.listdir(self.tmp.name).count("roster.txt"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()